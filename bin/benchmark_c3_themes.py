@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+Benchmark for the cross-cutting themes join in `build_data.c3_ready_json`.
+
+Compares the old approach, where the themes were parsed again for every
+country, with the current one, where they are parsed once and joined by
+country code. A synthetic THEMES_SHEET is used so the number of countries
+can be changed.
+
+Run from the repo root:
+
+    python bin/benchmark_c3_themes.py
+    python bin/benchmark_c3_themes.py -n 15 100 200 -r 3
+'''
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import build_data  # noqa
+from rtei.countries import get_country_index  # noqa
+
+
+def themes_sheet(country_names, themes=9, subthemes=2, indicators=5):
+    '''
+    Returns a `SheetTable` laid out like the THEMES_SHEET, with one column
+    per country.
+    '''
+    def values_row(title):
+        return [build_data.SheetCell(title, 'General')] + [
+            build_data.SheetCell(0.5, '0%') for name in country_names]
+
+    rows = [[build_data.SheetCell('Theme', 'General')] + [
+        build_data.SheetCell(name, 'General') for name in country_names]]
+    for t in range(1, themes + 1):
+        rows.append([build_data.SheetCell('{0} Theme'.format(t), 'General')])
+        for letter in 'ABCDEFGH'[:subthemes]:
+            code = '{0}{1}'.format(t, letter)
+            rows.append(
+                [build_data.SheetCell(code + ' Subtheme', 'General')])
+            for i in range(1, indicators + 1):
+                rows.append([build_data.SheetCell(
+                    '1.1.{0}a Indicator'.format(i), 'General')])
+            rows.append(values_row(code + ' Subtheme'))
+        rows.append(values_row('{0} Theme'.format(t)))
+
+    return build_data.SheetTable(rows)
+
+
+def legacy_join(build, country_codes):
+    items = []
+    for country_code in country_codes:
+        # Parse the whole sheet again for each country
+        build.themes_table = None
+        themes = build_data.themes_per_country(build, prefix='t')
+        items.append(dict(themes[country_code]))
+    return items
+
+
+def current_join(build, country_codes):
+    build.themes_table = None
+    themes = build_data.themes_per_country(build, prefix='t')
+    items = []
+    for country_code in country_codes:
+        items.append(dict(themes[country_code]))
+    return items
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the themes join of the C3 output')
+    parser.add_argument('-n', '--countries', type=int, nargs='+',
+                        default=[15, 100, 200],
+                        help='Number of countries to test with')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of runs for each test (best is kept)')
+    args = parser.parse_args()
+
+    all_names = [c['name'] for c in get_country_index().countries.values()]
+
+    print('{0:>10} {1:>12} {2:>12} {3:>8}'.format(
+        'countries', 'legacy (s)', 'current (s)', 'speedup'))
+    for n in args.countries:
+        names = all_names[:n]
+        build = build_data.DataBuild(None, None)
+        build._sheets = {build_data.THEMES_SHEET: themes_sheet(names)}
+        codes = list(build_data.get_themes_table(build).values.keys())
+
+        assert legacy_join(build, codes) == current_join(build, codes)
+
+        legacy = min(timeit.repeat(lambda: legacy_join(build, codes),
+                                   number=1, repeat=args.repeat))
+        current = min(timeit.repeat(lambda: current_join(build, codes),
+                                    number=1, repeat=args.repeat))
+        print('{0:>10} {1:>12.4f} {2:>12.4f} {3:>7.1f}x'.format(
+            len(codes), legacy, current, legacy / current))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+'''
+Benchmark for the two ways the site can load the data files of a year: the
+cold path, where each worker parses the JSON files (as `OrderedDict`
+objects) on its first requests, and the preload path, where the datasets
+(see `YearDataset`) are built once by `rtei.data.preload` before gunicorn
+forks the workers, which then just get them with `get_dataset`.
+
+It also checks that the datasets hold the same values as the JSON files.
+
+Run from the repo root:
+
+    python bin/benchmark_data_load.py
+    python bin/benchmark_data_load.py -y 2018 2021 -r 10
+'''
+import os
+import sys
+import argparse
+import glob
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtei.settings.dev')
+
+import django  # noqa
+django.setup()
+
+from django.conf import settings  # noqa
+
+from rtei import data  # noqa
+
+
+# Loaded by `YearDataset`, along with the file of each country
+DATASET_FILES = ['indicators.json', 'themes.json', 'scores_per_country.json',
+                 'c3_scores_per_country.json', 'countries_with_data.json']
+
+
+def get_data_files(year):
+    file_names = [name for name in DATASET_FILES
+                  if os.path.exists(data.get_file_path(name, year))]
+    file_names.extend(sorted(
+        os.path.basename(path)
+        for path in glob.glob(data.get_file_path('??.json', year))))
+    return file_names
+
+
+def json_load(year, file_names):
+    return dict(
+        (file_name, data.load_json_file(data.get_file_path(file_name, year)))
+        for file_name in file_names)
+
+
+def dataset_load(year):
+    # Nothing is reused from previous runs
+    data._file_cache.clear()
+    return data.YearDataset(year, data.get_data_version(year))
+
+
+def check_dataset(dataset, files):
+    assert dataset.indicators == files['indicators.json']
+    assert dataset.scores == files['scores_per_country.json']
+    assert dataset.c3_scores == files['c3_scores_per_country.json']
+    for country_code, values in dataset.countries.items():
+        assert list(values.items()) == list(
+            files['{0}.json'.format(country_code)].items())
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark loading the data files on each worker or '
+                    'preloading the datasets')
+    parser.add_argument('-y', '--years', nargs='+', default=settings.YEARS,
+                        help='Years to test with')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs for each test (best is kept)')
+    args = parser.parse_args()
+
+    print('{0:>6} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+        'year', 'files', 'json (ms)', 'json (KB)', 'load (ms)', 'load (KB)',
+        'get (us)'))
+    for year in args.years:
+        file_names = get_data_files(year)
+        files = json_load(year, file_names)
+        dataset = dataset_load(year)
+        check_dataset(dataset, files)
+
+        json_time = min(timeit.repeat(
+            lambda: json_load(year, file_names), number=1,
+            repeat=args.repeat))
+        load_time = min(timeit.repeat(
+            lambda: dataset_load(year), number=1, repeat=args.repeat))
+
+        # What each request costs once the dataset is preloaded
+        data.preload([year])
+        get_time = min(timeit.repeat(
+            lambda: data.get_dataset(year), number=1000,
+            repeat=args.repeat)) / 1000
+
+        print('{0:>6} {1:>6} {2:>10.2f} {3:>10.1f} {4:>10.2f} {5:>10.1f} '
+              '{6:>10.2f}'.format(
+                  year, len(file_names), json_time * 1000,
+                  data.get_memory_size(files) / 1024, load_time * 1000,
+                  dataset.get_memory_size() / 1024, get_time * 1000000))
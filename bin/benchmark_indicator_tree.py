@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+'''
+Benchmark for the two ways of rendering the indicator trees of the data
+pages: the recursive template they used to be rendered with (see
+`REFERENCE_TEMPLATE`, which includes itself once for each node with
+children) and the `indicator_tree` tag, which renders the flattened tree in
+one pass with the display values precomputed by the dataset.
+
+It also checks that both produce exactly the same output, for every country
+(and no country, as on the map page) and language.
+
+Run from the repo root:
+
+    python bin/benchmark_indicator_tree.py
+    python bin/benchmark_indicator_tree.py -y 2016 -r 10
+'''
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtei.settings.dev')
+
+import django  # noqa
+django.setup()
+
+from django.conf import settings  # noqa
+from django.template import Context, Engine  # noqa
+from django.utils import translation  # noqa
+
+from rtei import data  # noqa
+from rtei.templatetags.rtei_tags import indicator_tree  # noqa
+
+
+# The output of `indicator_tree` must be exactly the same as this, whitespace
+# included
+REFERENCE_TEMPLATE = '''{% load i18n rtei_tags %}
+
+{% for indicator in indicators %}
+  {% if indicator.show_in_menu is not False %}
+    <li id="indicator_container_{{ indicator.code }}" class="indicator-container">
+      <div id="indicator_item_{{ indicator.code }}" class="indicator">
+        <span class="indicator-title">
+          <span class="code">{{ indicator.code }}</span>{% trans indicator.title %}
+        </span>
+
+        {% if country_indicators %}
+        <span class="indicator-value">
+          {% get_indicator_value country_indicators indicator.code indicator.level as indicator_value %}
+          {{ indicator_value }}
+        </span>
+        {% endif %}
+      </div>
+      {% if indicator.children %}
+        <ul>
+        {% include "indicators.html" with indicators=indicator.children %}
+        </ul>
+      {% endif %}
+    </li>
+  {% endif %}
+{% endfor %}
+'''
+
+engine = Engine(
+    loaders=[('django.template.loaders.locmem.Loader',
+              {'indicators.html': REFERENCE_TEMPLATE})],
+    libraries={'i18n': 'django.templatetags.i18n',
+               'rtei_tags': 'rtei.templatetags.rtei_tags'})
+reference_template = engine.get_template('indicators.html')
+
+
+def render_recursive(indicators, country_indicators):
+    return reference_template.render(Context({
+        'indicators': indicators,
+        'country_indicators': country_indicators,
+    }))
+
+
+def get_trees(dataset):
+    '''
+    Returns the `(nodes, rows)` of all trees rendered on a page.
+    '''
+    subthemes = [subtheme for theme in dataset.themes
+                 for subtheme in theme.get('children', [])]
+    return [(dataset.indicators, dataset.indicator_rows)] + [
+        (subtheme.get('indicators', []), rows) for subtheme, (code, rows)
+        in zip(subthemes, dataset.theme_indicator_rows)]
+
+
+def render_page_recursive(trees, country_indicators):
+    return [render_recursive(nodes, country_indicators)
+            for nodes, rows in trees]
+
+
+def render_page_flat(trees, dataset, country_code):
+    display_values = None
+    if country_code:
+        display_values = dataset.get_display_values(
+            country_code, translation.get_language())
+    return [indicator_tree(rows, display_values) for nodes, rows in trees]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark rendering the indicator trees recursively or '
+                    'in one pass')
+    parser.add_argument('-y', '--years', nargs='+', default=settings.YEARS,
+                        help='Years to test with')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs for each test (best is kept)')
+    args = parser.parse_args()
+
+    print('{0:>6} {1:>6} {2:>10} {3:>10} {4:>8}'.format(
+        'year', 'nodes', 'rec (ms)', 'flat (ms)', 'speedup'))
+    for year in args.years:
+        dataset = data.get_dataset(year)
+        trees = get_trees(dataset)
+        country_codes = [None] + sorted(dataset.countries)
+
+        for language, name in settings.LANGUAGES:
+            with translation.override(language):
+                for country_code in country_codes:
+                    country_indicators = dataset.countries.get(country_code)
+                    assert (render_page_recursive(trees, country_indicators) ==
+                            render_page_flat(trees, dataset, country_code))
+
+        # Time the page of the last country, in the default language
+        with translation.override(settings.LANGUAGE_CODE):
+            country_code = country_codes[-1]
+            country_indicators = dataset.countries[country_code]
+            recursive_time = min(timeit.repeat(
+                lambda: render_page_recursive(trees, country_indicators),
+                number=1, repeat=args.repeat))
+            flat_time = min(timeit.repeat(
+                lambda: render_page_flat(trees, dataset, country_code),
+                number=1, repeat=args.repeat))
+
+        print('{0:>6} {1:>6} {2:>10.2f} {3:>10.2f} {4:>7.1f}x'.format(
+            year, sum(len(rows) for nodes, rows in trees),
+            recursive_time * 1000, flat_time * 1000,
+            recursive_time / flat_time))
@@ -5,24 +5,36 @@ Data script for the RTEI website.
 Check ./build_data.py -h for details
 '''
 import re
+import io
 import os
+import sys
 import simplejson as json
 import csv
+import hashlib
 import argparse
+import glob
 import random
-import string
 import math
 import locale
-from collections import OrderedDict
-from decimal import Decimal
+import shutil
+import tempfile
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_HALF_UP
 
 from openpyxl import load_workbook
 
+from rtei.code_tree import (
+    build_tree, indicator_parent_codes, theme_parent_codes)
+from rtei.countries import COUNTRIES_FILE, get_country_index
+
 # Change as appropiate
 INPUT_FILE = 'rtei/static/data/rtei_data_2021.xlsx'
 OUTPUT_DIR = 'rtei/static/data/2021'
 
-COUNTRIES_FILE = 'data/countries.json'
+# Used when building more than one year (see `build_years`)
+INPUT_FILE_PATTERN = 'rtei/static/data/rtei_data_{year}.xlsx'
+OUTPUT_DIR_PATTERN = 'rtei/static/data/{year}'
 
 CORE_SHEET = 'All questionnaires'
 MAIN_SCORES_SHEET = 'Country comparisons'
@@ -31,6 +43,31 @@ THEMES_MAPPINGS_SHEET = 'Transversal Themes Mappings'
 
 INSUFFICIENT_DATA = 'Insufficient data'
 
+# Records the hashes of the inputs and outputs of the last build, stored in the
+# output dir
+MANIFEST_FILE = 'build_manifest.json'
+MANIFEST_VERSION = 1
+
+# The `rtei` modules imported by the script. They affect the outputs as much as
+# the script itself, so their hashes are recorded on the manifest too
+BUILD_MODULES = ['rtei.code_tree', 'rtei.countries']
+
+# Decimal places that numeric values are rounded to on the JSON outputs, by
+# indicator level. These match what the site displays anyway (see
+# `get_indicator_value` in rtei/templatetags/rtei_tags.py)
+OUTPUT_PRECISION = {1: 0, 2: 0, 3: 2, 4: 2, 5: 2}
+
+# The overall index is displayed with the `floatformat` filter, which rounds
+# half up
+INDEX_PRECISION = 0
+
+# The C3 charts scale the values back before rounding them, so these keep
+# more decimals
+C3_PRECISION = 4
+
+# Separators used for the JSON outputs, unless `--no-compact` is passed
+COMPACT_SEPARATORS = (',', ':')
+
 # Ensure proper currency formatting
 locale.setlocale(locale.LC_ALL, 'en_US.utf-8')
 
@@ -134,12 +171,6 @@ EXTRA_INDICATORS = [
     },
 ]
 
-# Excel handler
-wb = None
-
-# Countries dictionary
-countries = None
-
 '''
 This will match any codes at the beginning of the string, starting with
 a number and ending with a space, eg:
@@ -151,6 +182,137 @@ a number and ending with a space, eg:
 valid_code = re.compile(r'^(C )?(\d)(.*?)? ')
 
 
+SheetCell = namedtuple('SheetCell', ['value', 'number_format'])
+
+EMPTY_CELL = SheetCell(None, 'General')
+
+
+class SheetTable(object):
+    '''
+    In-memory copy of a worksheet, read in a single forward pass.
+
+    Rows and columns are 1-based, as on the spreadsheet. Cells are returned as
+    `SheetCell` tuples, with `value` and `number_format` attributes, and
+    cells outside the used range are returned as `EMPTY_CELL`.
+    '''
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.max_row = len(rows)
+        self.max_column = max([len(row) for row in rows] or [0])
+
+    def cell(self, row, column):
+        try:
+            return self._rows[row - 1][column - 1]
+        except IndexError:
+            return EMPTY_CELL
+
+    def row(self, row):
+        '''
+        Returns a list with all cells of the row, padded up to `max_column`
+        '''
+        cells = self._rows[row - 1] if row <= self.max_row else []
+        return cells + [EMPTY_CELL] * (self.max_column - len(cells))
+
+    def column(self, column):
+        '''
+        Returns a list with all cells of the column, up to `max_row`
+        '''
+        return [self.cell(row, column) for row in range(1, self.max_row + 1)]
+
+
+def read_sheet(ws):
+    '''
+    Reads a (read-only) worksheet into a `SheetTable`, iterating over its rows
+    just once. Trailing empty cells are dropped from each row.
+    '''
+    rows = []
+    for ws_row in ws.iter_rows():
+        row = []
+        for cell in ws_row:
+            if cell.value is None:
+                row.append(EMPTY_CELL)
+            else:
+                row.append(SheetCell(cell.value, cell.number_format))
+        while row and row[-1] is EMPTY_CELL:
+            row.pop()
+        rows.append(row)
+    return SheetTable(rows)
+
+
+def load_sheets(input_file,
+                sheet_names=(CORE_SHEET, MAIN_SCORES_SHEET, THEMES_SHEET)):
+    '''
+    Streams the sheets we need from the workbook in read-only mode and returns
+    a dict of `SheetTable` objects keyed by sheet name.
+
+    Sheets not present on the workbook are skipped, so they will only fail
+    when accessed.
+    '''
+    workbook = load_workbook(input_file, read_only=True, data_only=True)
+
+    out = {}
+    for sheet_name in sheet_names:
+        if sheet_name in workbook.sheetnames:
+            out[sheet_name] = read_sheet(workbook[sheet_name])
+    return out
+
+
+class DataBuild(object):
+    '''
+    State for building the data files of one workbook: the parsed sheets, the
+    values shared by all outputs and the build manifest.
+
+    The sheets are only loaded from `input_file` the first time they are
+    needed.
+    '''
+
+    def __init__(self, input_file, output_dir, compact=True):
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.compact = compact
+
+        # See `get_data_cube` and `get_themes_table`
+        self.data_cube = None
+        self.themes_table = None
+
+        self._sheets = None
+        self._sheet_names = None
+        self._manifest = None
+
+    @property
+    def sheets(self):
+        if self._sheets is None:
+            self._sheets = load_sheets(self.input_file)
+        return self._sheets
+
+    @property
+    def sheet_names(self):
+        '''
+        Names of the sheets on the workbook, without loading any of them.
+        '''
+        if self._sheet_names is None:
+            workbook = load_workbook(self.input_file, read_only=True)
+            self._sheet_names = list(workbook.sheetnames)
+        return self._sheet_names
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            inputs = get_input_hashes(self.input_file)
+            inputs['compact'] = self.compact
+            self._manifest = BuildManifest(self.output_dir, inputs)
+        return self._manifest
+
+    def dumps(self, out):
+        '''
+        Serializes an output as JSON, without whitespace if `compact` is set.
+        '''
+        if self.compact:
+            return json.dumps(out, separators=COMPACT_SEPARATORS)
+        return json.dumps(out)
+
+
 def get_country_code(country_name, code_type='iso2'):
     '''
     Given a country name, return its ISO code
@@ -158,28 +320,14 @@ def get_country_code(country_name, code_type='iso2'):
     By default to the 2 digit code is returned (eg 'AF' for Afghanistan),
     passing code_type='iso3' will return the 3 digit code (eg'AFG').
     '''
-    if not country_name:
-        return None
-    for code, country in countries.items():
-        if (country_name.lower() == country['name'].lower() or
-                country_name.lower() in [x.lower() for x in country.get('other_names', [])]):
-            return country[code_type]
-
-    return None
+    return get_country_index().get_country_code(country_name, code_type)
 
 
 def get_country_name(country_code):
     '''
     Given a country code, return the corresponding country name.
     '''
-    code_type = 'iso2'
-    if len(country_code) == 3:
-        code_type = 'iso3'
-
-    return next(
-        (c['name'] for code, c in countries.items()
-         if c[code_type] == country_code.upper()),
-        None)
+    return get_country_index().get_country_name(country_code)
 
 
 def get_numeric_cell_value(cell):
@@ -218,6 +366,41 @@ def get_level_for_indicator(code):
     return level
 
 
+def round_value(value, places, rounding=ROUND_HALF_EVEN):
+    '''
+    Rounds a numeric value to `places` decimal places. Integers and non
+    numeric values (eg 'No data') are returned as they are.
+
+    Values rounded to 0 places become integers. Otherwise they are kept as
+    decimals even if they have no fractional part, as the site displays eg
+    1.0 and 1 differently.
+    '''
+    if not isinstance(value, (float, Decimal)):
+        return value
+    # Round the float the site would load, so the result is the same that
+    # rounding it there would give
+    value = Decimal(float(value)).quantize(Decimal(1).scaleb(-places),
+                                    rounding=rounding)
+    if places == 0:
+        return int(value)
+    return value
+
+
+def round_indicator_values(values):
+    '''
+    Given the values of a country, keyed by indicator code, returns a new dict
+    with them rounded as defined on OUTPUT_PRECISION and INDEX_PRECISION.
+    '''
+    out = OrderedDict()
+    for code, value in values.items():
+        if code == 'index':
+            out[code] = round_value(value, INDEX_PRECISION, ROUND_HALF_UP)
+        else:
+            level = get_level_for_indicator(code)
+            out[code] = round_value(value, OUTPUT_PRECISION[level])
+    return out
+
+
 def get_level_for_theme(code):
     if not code[-1].isalpha():
         # 1
@@ -304,7 +487,7 @@ def parse_cell(value, theme=False):
     return code, title, level
 
 
-def get_themes(include_rows=False, include_indicators=False):
+def get_themes(build, include_rows=False, include_indicators=False):
     '''
     Returns a list of dicts describing the transversal themes. Each of the
     dicts contains the following keys:
@@ -318,14 +501,15 @@ def get_themes(include_rows=False, include_indicators=False):
 
     '''
 
-    out = []
+    # Level 1 and 2 themes, keyed by code
+    registry = OrderedDict()
     sheet = THEMES_SHEET
-    ws = wb[sheet]
+    ws = build.sheets[sheet]
 
-    codes_done = []
+    codes_done = set()
     theme = None
-    for i in range(2, len(ws.rows) + 1):
-        cell = ws.cell(row=i, column=1)
+    for i in range(2, ws.max_row + 1):
+        cell = ws.cell(i, 1)
         if not cell.value:
             continue
 
@@ -342,12 +526,12 @@ def get_themes(include_rows=False, include_indicators=False):
 
         if level in (1, 2) and code in codes_done:
             if include_rows:
-                previous_theme = [t for t in out if t['code'] == code][0]
+                previous_theme = registry[code]
                 # This is the values row
                 previous_theme['row'] = i
             continue
 
-        codes_done.append(code)
+        codes_done.add(code)
 
         if level in (1, 2):
             theme = {
@@ -356,7 +540,7 @@ def get_themes(include_rows=False, include_indicators=False):
                 'level': level
             }
 
-            out.append(theme)
+            registry[code] = theme
 
         if include_indicators and level in (3, 4):
             if 'indicators' not in theme:
@@ -367,10 +551,10 @@ def get_themes(include_rows=False, include_indicators=False):
                 'title': title
             })
 
-    return out
+    return list(registry.values())
 
 
-def get_indicators(include_columns=False):
+def get_indicators(build, include_columns=False):
     '''
     Returns a list of dicts describing the indicators. Each of the dicts
     contains the following keys:
@@ -382,39 +566,39 @@ def get_indicators(include_columns=False):
             indicators into account this is straight forward: 1 -> 1, 1.1 -> 2,
             1.1.1 -> 3, 1.1.1a -> 4. Derived indicators can have the following
             levels: 1.2a -> 2 and 1.1.1a_resp_ad -> 4.
-        * `column` (optional, only if `include_columns` is True): The column on
-            the spreadsheet that holds the values for the indicator.
+        * `column` (optional, only if `include_columns` is True): The column
+            index (1-based) on the spreadsheet that holds the values for the
+            indicator.
 
     '''
 
-    out = []
+    # Indicators keyed by code, in the order they are found. On the last header
+    # row each indicator gets bound to the columns that hold its value,
+    # response and year.
+    registry = OrderedDict()
 
-    ws = wb[CORE_SHEET]
+    ws = build.sheets[CORE_SHEET]
 
     # First four rows
-    codes_done = []
     for i in (0, 1, 2, 3):
-        for cell in ws.rows[i]:
+        for column, cell in enumerate(ws.row(i + 1), 1):
             indicator = None
             if cell.value:
                 code, title, level = parse_cell(cell.value)
 
                 if not code:
                     continue
-                if code in codes_done:
+                if code in registry:
                     if i == 3:
                         # Use the previous one
-                        indicator = [o for o in out if o['code'] == code][0]
+                        indicator = registry[code]
                     else:
                         continue
                 elif '_year' in code and i == 3:
                     try:
-                        indicator = [o for o in out
-                                     if o['code'] == code.replace('_year', '')][0]
-                    except IndexError:
+                        indicator = registry[code.replace('_year', '')]
+                    except KeyError:
                         import ipdb; ipdb.set_trace()
-                else:
-                    codes_done.append(code)
 
                 if not indicator:
                     indicator = {
@@ -422,27 +606,27 @@ def get_indicators(include_columns=False):
                         'title': title,
                         'level': level
                     }
-                    out.append(indicator)
+                    registry[code] = indicator
                 if i == 3 and include_columns:
                     if title == 'Response':
-                        indicator['column_response'] = cell.column
+                        indicator['column_response'] = column
                     elif '_year' in code:
-                        indicator['column_year'] = cell.column
+                        indicator['column_year'] = column
                     else:
-                        indicator['column'] = cell.column
+                        indicator['column'] = column
             else:
                 # Other indicators
                 # print cell.value
                 pass
-    return out
+    return list(registry.values())
 
 
-def get_all_indicators(include_columns=False):
+def get_all_indicators(build, include_columns=False):
     '''
     Returns a list of all indicators. See get_indicators for details.
     '''
 
-    indicators = get_indicators(include_columns=include_columns)
+    indicators = get_indicators(build, include_columns=include_columns)
 
     # Add extra indicators not defined in the core sheet
     indicators = indicators + EXTRA_INDICATORS
@@ -450,7 +634,7 @@ def get_all_indicators(include_columns=False):
     return indicators
 
 
-def get_main_scores():
+def get_main_scores(build):
     '''
     Return the values for the level 1 indicators (ie 1, 2, 3, 4 and 5),
     SPO and global index for a particular country.
@@ -459,23 +643,24 @@ def get_main_scores():
 
     '''
 
-    ws = wb[MAIN_SCORES_SHEET]
+    ws = build.sheets[MAIN_SCORES_SHEET]
 
     row_index = None
 
-    value_columns = [chr(i) for i in range(ord('B'), ord('J') + 1)]
+    # Columns B to J
+    value_columns = list(range(2, 11))
 
     indicators = MAIN_INDICATORS + EXTRA_INDICATORS
 
     out = {}
 
     # Get the country row
-    for cell in ws.columns[0]:
+    for row, cell in enumerate(ws.column(1), 1):
 
         name = cell.value
 
         if not name:
-            if cell.row > 3:
+            if row > 3:
                 break
             else:
                 continue
@@ -488,14 +673,13 @@ def get_main_scores():
             print(('Could not find a data row for country {}'.format(country_code)))
             continue
 
-        row_index = cell.row
+        row_index = row
 
         out[country_code] = {}
 
         # Read values for that row (columns B to J)
         for column in value_columns:
-            indicator_cell = '{}{}'.format(column, 1)
-            indicator_title = ws[indicator_cell].value
+            indicator_title = ws.cell(1, column).value
             indicator_code = None
 
             # Get indicator code
@@ -516,29 +700,169 @@ def get_main_scores():
                 print(('Could not find code for indicator {}'.format(indicator_title)))
                 continue
 
-            value_cell = '{}{}'.format(column, row_index)
-            value = get_numeric_cell_value(ws[value_cell])
+            value = get_numeric_cell_value(ws.cell(row_index, column))
 
 
             out[country_code][indicator_code] = value * 100 if not isinstance(value, str) and value <= 1 else value
 
     return out
 
-def add_main_scores(indicators):
+def get_indicator_cell_value(indicator, cell, cell_year=None,
+                             number_format=False):
+    '''
+    Returns the value of an indicator for a particular country, given the
+    sheet cell that holds it.
+
+    If `cell_year` is provided, the year it contains is appended to the value,
+    eg `45.5 (2019)`.
+
+    See `indicators_per_country` for details on the rest of transformations.
+    '''
+    value = get_numeric_cell_value(cell)
+
+    if value == 999:
+        value = 'No data'
+    elif value == 997:
+        value = 'N/A'
+
+    if indicator['level'] >= 3 and number_format:
+        if cell.number_format == '0%':
+            if not isinstance(value, str):
+                value = str(math.trunc(value * 100)) + '%'
+        elif '$' in cell.number_format:
+            value = locale.currency(value, grouping=True)
+
+    if cell_year is not None:
+        value = round(value, 2) if not isinstance(value, str) else value
+        year = 'N/A' if cell_year.value == 997 else cell_year.value
+        value = '{0} ({1})'.format(value, year)
+
+    if (indicator['code'].count('.') == 1 and
+            not indicator['code'][-1].isalpha() and
+            value is not None and value not in ('No data', INSUFFICIENT_DATA)):
+        value = Decimal(value * 100 if value <= 1 else value)
+
+    return value
+
+
+class DataCube(object):
     '''
-    Add the values for the level 1 indicators (ie 1, 2, 3, 4 and 5) to the
-    passed country_indicators dict.
+    Values for all indicators for all countries, parsed once from the
+    CORE_SHEET and shared by all outputs.
+
+    Values are stored in different views, keyed by a `(responses,
+    number_format)` tuple (see `indicators_per_country` for what these mean):
+
+        * `RAW`: the actual indicator values
+        * `RESPONSE`: the user-friendly responses, with years when available
+        * `FORMATTED`: the responses with any number formatting applied
+        * `RAW_FORMATTED`: the actual values with number formatting applied
 
     '''
-    main_scores = get_main_scores()
-    for k in indicators:
-        if k not in main_scores:
+
+    RAW = (False, False)
+    RESPONSE = (True, False)
+    FORMATTED = (True, True)
+    RAW_FORMATTED = (False, True)
+
+    def __init__(self, indicators, country_codes, views, main_scores):
+        self.indicators = indicators
+        self.country_codes = country_codes
+        self.views = views
+        self.main_scores = main_scores
+
+    def project(self, max_level=4, derived=True, responses=True,
+                number_format=False):
+        '''
+        Returns a new dict with the values of the requested view for all
+        countries, in the form returned by `indicators_per_country`.
+        '''
+        view = self.views[(responses, number_format)]
+
+        codes = [
+            indicator['code'] for indicator in self.indicators
+            if indicator['level'] <= max_level and indicator.get('column') and
+            # Avoid derived indicators (eg 1.2a or 3.2.1_ag)
+            (derived or not indicator['code'][-1].isalpha())]
+
+        out = OrderedDict()
+        for country_code, values in view.items():
+            out[country_code] = OrderedDict(
+                (code, values[code]) for code in codes)
+
+        for country_code, scores in self.main_scores.items():
+            if country_code in out:
+                out[country_code].update(scores)
+
+        return out
+
+
+def get_data_cube(build):
+    '''
+    Returns the `DataCube` for the build workbook, parsing it only on the
+    first call.
+    '''
+    if build.data_cube is None:
+        build.data_cube = build_data_cube(build)
+    return build.data_cube
+
+
+def build_data_cube(build):
+
+    indicators = get_all_indicators(build, include_columns=True)
+
+    ws_core = build.sheets[CORE_SHEET]
+    country_codes = []
+
+    for i in range(5, ws_core.max_row + 1):
+        country_name = ws_core.cell(i, 1).value
+        if not country_name:
             continue
-        indicators[k].update(main_scores[k])
+        country_code = get_country_code(country_name)
+        if not country_code:
+            print('Warning: Could not get country code for {0}'.format(
+                country_name))
+        country_codes.append(country_code)
+
+    views = {}
+    for view in (DataCube.RAW, DataCube.RESPONSE, DataCube.FORMATTED,
+                 DataCube.RAW_FORMATTED):
+        views[view] = OrderedDict(
+            (country_code, OrderedDict()) for country_code in country_codes)
+
+    for i, country_code in enumerate(country_codes):
+        for indicator in indicators:
+            if not indicator.get('column'):
+                continue
+
+            cell = ws_core.cell(i + 5, indicator['column'])
+            if indicator.get('column_response'):
+                cell_response = ws_core.cell(
+                    i + 5, indicator['column_response'])
+            else:
+                cell_response = cell
+            if indicator.get('column_year'):
+                cell_year = ws_core.cell(i + 5, indicator['column_year'])
+            else:
+                cell_year = None
+
+            code = indicator['code']
+            views[DataCube.RAW][country_code][code] = \
+                get_indicator_cell_value(indicator, cell)
+            views[DataCube.RAW_FORMATTED][country_code][code] = \
+                get_indicator_cell_value(indicator, cell, number_format=True)
+            views[DataCube.RESPONSE][country_code][code] = \
+                get_indicator_cell_value(indicator, cell_response, cell_year)
+            views[DataCube.FORMATTED][country_code][code] = \
+                get_indicator_cell_value(indicator, cell_response, cell_year,
+                                         number_format=True)
 
+    return DataCube(indicators, country_codes, views, get_main_scores(build))
 
-def indicators_per_country(max_level=4, derived=True, random_values=False,
-                           responses=True, number_format=False):
+
+def indicators_per_country(build, max_level=4, derived=True,
+                           random_values=False, responses=True,
+                           number_format=False):
     '''
     Returns a dict containing the values for all indicators for all countries,
     with the following structure:
@@ -597,84 +921,79 @@ def indicators_per_country(max_level=4, derived=True, random_values=False,
 
     Values with `999` are replaced with `No data` and `997` with `N/A`.
 
-    '''
+    Values are projected from the `DataCube`, so the workbook is only parsed
+    once no matter how many times this is called.
 
-    out = OrderedDict()
+    '''
 
-    indicators = get_all_indicators(include_columns=True)
+    cube = get_data_cube(build)
 
-    ws_core = wb[CORE_SHEET]
-    country_codes = []
+    out = cube.project(max_level=max_level, derived=derived,
+                       responses=responses, number_format=number_format)
 
-    for i in range(5, len(ws_core.rows) + 1):
-        country_name = ws_core['A' + str(i)].value
-        if not country_name:
-            continue
-        country_code = get_country_code(country_name)
-        if not country_code:
-            print('Warning: Could not get country code for {0}'.format(
-                country_name))
-        country_codes.append(country_code)
-        out[country_code] = OrderedDict()
+    if random_values:
+        for code, country in get_country_index().countries.items():
+            if country['iso2'] not in cube.country_codes and country['iso2']:
+                out[country['iso2']] = OrderedDict()
+                for indicator in cube.indicators:
+                    if (indicator['level'] <= 2 and
+                            not indicator['code'][-1].isalpha()):
+                        out[country['iso2']][indicator['code']] = \
+                            random.randint(0, 100)
+    return out
 
-    for i, country_code in enumerate(country_codes):
-        for indicator in indicators:
-            if indicator['level'] <= max_level and indicator.get('column'):
 
-                if not derived and indicator['code'][-1].isalpha():
-                    # Avoid derived indicators (eg 1.2a or 3.2.1_ag)
-                    continue
-                if responses and indicator.get('column_response'):
-                    cell = indicator['column_response'] + str(i + 5)
-                else:
-                    cell = indicator['column'] + str(i + 5)
+ThemesTable = namedtuple('ThemesTable', ['themes', 'country_codes', 'values'])
 
+def get_themes_table(build):
+    '''
+    Returns the `ThemesTable` for the build workbook, parsing the
+    THEMES_SHEET only on the first call.
+    '''
+    if build.themes_table is None:
+        build.themes_table = build_themes_table(build)
+    return build.themes_table
 
-                value = get_numeric_cell_value(ws_core[cell])
 
-                if value == 999:
-                    value = 'No data'
-                elif value == 997:
-                    value = 'N/A'
+def build_themes_table(build):
+    '''
+    Reads the values of all level 1 and 2 themes for all countries on the
+    THEMES_SHEET, where each country is a column.
+    '''
 
-                if indicator['level'] >= 3 and number_format:
-                    number_format = ws_core[cell].number_format
-                    if number_format == '0%':
-                        if not isinstance(value, str):
-                            value = str(math.trunc(value * 100)) + '%'
-                    elif '$' in number_format:
-                        value = locale.currency(value, grouping=True)
+    themes = get_themes(build, include_rows=True)
+    ws = build.sheets[THEMES_SHEET]
 
-                if (responses and indicator.get('column_year')):
-                    cell_year = indicator['column_year'] + str(i + 5)
-                    value = round(value, 2) if not isinstance(value, str) else value
-                    year = 'N/A' if ws_core[cell_year].value == 997 else ws_core[cell_year].value
-                    value = '{0} ({1})'.format(value, year)
+    country_codes = []
+    values = OrderedDict()
+    for column in range(2, ws.max_column + 1):
+        country_name = ws.cell(1, column).value
+        if not country_name:
+            break
+        country_code = get_country_code(country_name)
+        if not country_code:
+            print('Warning: Could not get country code for {0}'.format(
+                country_name))
+        country_codes.append(country_code)
+        values[country_code] = OrderedDict()
 
-                out[country_code][indicator['code']] = value
+        for theme in themes:
+            if theme['level'] in (1, 2) and theme.get('row'):
+                value = get_numeric_cell_value(ws.cell(theme['row'], column))
 
-                if (indicator['code'].count('.') == 1 and
-                        not indicator['code'][-1].isalpha() and
-                        value is not None and value not in ('No data', INSUFFICIENT_DATA)):
-                    out[country_code][indicator['code']] = Decimal(
-                        value * 100 if value <= 1 else value)
+                if isinstance(value, str):
+                    value = None
 
+                # Output as percentages
+                if value:
+                    value = value * 100
 
-    add_main_scores(out)
+                values[country_code][theme['code']] = value
 
-    if random_values:
-        for code, country in countries.items():
-            if country['iso2'] not in country_codes and country['iso2']:
-                out[country['iso2']] = OrderedDict()
-                for indicator in indicators:
-                    if (indicator['level'] <= 2 and
-                            not indicator['code'][-1].isalpha()):
-                        out[country['iso2']][indicator['code']] = \
-                            random.randint(0, 100)
-    return out
+    return ThemesTable(themes, country_codes, values)
 
 
-def themes_per_country(prefix=None, random_values=False):
+def themes_per_country(build, prefix=None, random_values=False):
     '''
     Returns a dict containing the values for all themes for all countries,
     with the following structure:
@@ -701,49 +1020,24 @@ def themes_per_country(prefix=None, random_values=False):
 
     If `random_values` is True, countries not present in the spreadsheet are
     returned with random values.
-    '''
-
-    out = OrderedDict()
 
-    themes = get_themes(include_rows=True)
-    ws = wb[THEMES_SHEET]
-    available_countries = []
-    for letter in string.ascii_uppercase[1:]:
-        country_name = ws[letter + '1'].value
-        if not country_name:
-            break
-        country_code = get_country_code(country_name)
-        if not country_code:
-            print('Warning: Could not get country code for {0}'.format(
-                country_name))
-        available_countries.append((country_code, letter))
-        out[country_code] = OrderedDict()
-
-    for i, available_country in enumerate(available_countries):
-        country_code, letter = available_country
-        for theme in themes:
-            if theme['level'] in (1, 2) and theme.get('row'):
-                cell = letter + str(theme['row'])
-
-                value = get_numeric_cell_value(ws[cell])
-
-                if isinstance(value, str):
-                    value = None
-
-                key = str(prefix) + theme['code'] if prefix else theme['code']
+    Values are projected from the `ThemesTable`, so the THEMES_SHEET is only
+    parsed once no matter how many times this is called.
+    '''
 
-                # Output as percentages
-                if value:
-                    value = value * 100
+    table = get_themes_table(build)
 
-                out[country_code][key] = value
+    out = OrderedDict()
+    for country_code, values in table.values.items():
+        out[country_code] = OrderedDict(
+            (str(prefix) + code if prefix else code, value)
+            for code, value in values.items())
 
     if random_values:
-        country_codes = [c[0] for c in available_countries]
-        for code, country in countries.items():
-            if country['iso2'] not in country_codes and country['iso2']:
+        for code, country in get_country_index().countries.items():
+            if country['iso2'] not in table.country_codes and country['iso2']:
                 out[country['iso2']] = OrderedDict()
-                for theme in themes:
+                for theme in table.themes:
                     if (theme['level'] == 2):
                         key = (str(prefix) + theme['code'] if prefix
                                else theme['code'])
@@ -753,7 +1047,195 @@ def themes_per_country(prefix=None, random_values=False):
     return out
 
 
-def indicators_as_csv(output_dir=OUTPUT_DIR):
+def get_file_hash(path):
+    '''
+    Returns the SHA-256 hex digest of the contents of a file, or None if it
+    does not exist.
+    '''
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildManifest(object):
+    '''
+    Keeps track of the hashes of the inputs used to generate each output type
+    and of the files it generated, so outputs can be skipped on later runs if
+    nothing changed. It is stored as MANIFEST_FILE in the output dir, eg:
+
+        {
+            "version": 1,
+            "inputs": {
+                "workbook": "4d1c...",
+                "countries": "a9f3...",
+                "script": "0b7e...",
+                "modules": {
+                    "rtei.code_tree": "5e2a...",
+                    ...
+                }
+            },
+            "outputs": {
+                "indicators-json": {
+                    "inputs": {
+                        "workbook": "4d1c...",
+                        "countries": "a9f3...",
+                        "script": "0b7e...",
+                        "modules": {
+                            "rtei.code_tree": "5e2a...",
+                            ...
+                        },
+                        "options": {}
+                    },
+                    "files": {
+                        "indicators.json": "c0ff..."
+                    }
+                },
+                ...
+            },
+            "files": {
+                "indicators.json": "c0ff...",
+                ...
+            }
+        }
+
+    `files` contains all the files generated by any output type.
+    '''
+
+    def __init__(self, output_dir, inputs):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.inputs = inputs
+
+        previous = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                previous = json.load(f, object_pairs_hook=OrderedDict)
+        if not previous or previous.get('version') != MANIFEST_VERSION:
+            previous = {'outputs': {}}
+        self.previous = previous
+
+        # Keep the records of outputs not built in this run
+        self.outputs = OrderedDict(previous['outputs'])
+        self._current = None
+
+    def get_step_inputs(self, options):
+        inputs = OrderedDict(self.inputs)
+        inputs['options'] = OrderedDict(sorted(options.items()))
+        return inputs
+
+    def is_fresh(self, name, options):
+        '''
+        Returns True if the output type `name` was already built with the same
+        inputs and options, and all its files are still unchanged.
+        '''
+        previous = self.previous['outputs'].get(name)
+        if not previous or not previous['files']:
+            return False
+        if previous['inputs'] != self.get_step_inputs(options):
+            return False
+        for file_name, file_hash in previous['files'].items():
+            path = os.path.join(self.output_dir, file_name)
+            if get_file_hash(path) != file_hash:
+                return False
+        return True
+
+    def start(self, name, options):
+        self._current = OrderedDict([
+            ('inputs', self.get_step_inputs(options)),
+            ('files', OrderedDict()),
+        ])
+        self.outputs[name] = self._current
+
+    def add_file(self, path, file_hash):
+        if self._current is None:
+            return
+        file_name = os.path.relpath(path, self.output_dir)
+        self._current['files'][file_name] = file_hash
+
+    def as_dict(self):
+        files = OrderedDict()
+        for name, output in self.outputs.items():
+            files.update(output['files'])
+
+        return OrderedDict([
+            ('version', MANIFEST_VERSION),
+            ('inputs', self.inputs),
+            ('outputs', self.outputs),
+            ('files', OrderedDict(sorted(files.items()))),
+        ])
+
+    def save(self):
+        self._current = None
+        write_output(self.path, json.dumps(self.as_dict(), indent=2))
+
+
+def get_build_modules():
+    '''
+    Returns a dict with the paths of the `rtei` modules used by the script (see
+    `BUILD_MODULES`), keyed by module name.
+    '''
+    return OrderedDict(
+        (name, sys.modules[name].__file__) for name in BUILD_MODULES)
+
+
+def get_input_hashes(input_file):
+    return OrderedDict([
+        ('workbook', get_file_hash(input_file)),
+        ('countries', get_file_hash(COUNTRIES_FILE)),
+        ('script', get_file_hash(os.path.abspath(__file__))),
+        ('modules', OrderedDict(
+            (name, get_file_hash(path))
+            for name, path in get_build_modules().items())),
+    ])
+
+
+def write_output(output_file, content, manifest=None):
+    '''
+    Writes `content` to `output_file`, but only if it differs from what the
+    file already contains, so unchanged files keep their modification time.
+    The file is replaced atomically.
+
+    The file hash is recorded on `manifest` if provided.
+    '''
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    if get_file_hash(output_file) != file_hash:
+        tmp_file = output_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_file, output_file)
+
+    if manifest is not None:
+        manifest.add_file(output_file, file_hash)
+
+    return file_hash
+
+
+def run_output(build, name, func, force=False, **options):
+    '''
+    Calls the output function `func` with the provided options, unless the
+    build manifest shows that the output is up to date.
+    '''
+    if options.get('random_values'):
+        # These are written to different files
+        name = name + '-random'
+
+    if not force and build.manifest.is_fresh(name, options):
+        print('Skipping {0}, inputs have not changed'.format(name))
+        return False
+
+    build.manifest.start(name, options)
+    func(build, **options)
+    return True
+
+
+def indicators_as_csv(build):
     '''
     Write a CSV file with all indicators, in the form:
 
@@ -764,49 +1246,18 @@ def indicators_as_csv(output_dir=OUTPUT_DIR):
 
         ...
     '''
-    indicators = get_all_indicators()
-    output_file = os.path.join(output_dir, 'indicators.csv')
+    indicators = get_all_indicators(build)
+    output_file = os.path.join(build.output_dir, 'indicators.csv')
 
-    with open(output_file, 'w') as f:
-        w = csv.DictWriter(f, ['code', 'title', 'core', 'level'])
-        w.writeheader()
-        w.writerows(indicators)
+    f = io.StringIO()
+    w = csv.DictWriter(f, ['code', 'title', 'core', 'level'])
+    w.writeheader()
+    w.writerows(indicators)
 
+    write_output(output_file, f.getvalue(), build.manifest)
 
-def get_nested_indicators(parent_indicator, all_indicators):
-    if parent_indicator['level'] >= 4:
-        return
-    out = []
-    for indicator in all_indicators:
-        if (indicator['code'].startswith(parent_indicator['code']) and
-                indicator['level'] == parent_indicator['level'] + 1):
-            if indicator['level'] < 4:
-                nested_indicators = get_nested_indicators(indicator,
-                                                          all_indicators)
-                if nested_indicators:
-                    indicator['children'] = nested_indicators
-            out.append(indicator)
 
-    return out
-
-
-def get_nested_themes(parent_theme, all_themes):
-    out = []
-    for theme in all_themes:
-        numeric_part = ''.join([x for x in theme['code'] if x.isdigit()])
-        if (numeric_part == parent_theme['code']
-                and theme['level'] == parent_theme['level'] + 1):
-            if theme['level'] < 4:
-                nested_themes = get_nested_themes(theme,
-                                                  all_themes)
-                if nested_themes:
-                    theme['children'] = nested_themes
-            out.append(theme)
-
-    return out
-
-
-def indicators_as_json(output_dir=OUTPUT_DIR):
+def indicators_as_json(build):
     '''
     Write a JSON file with all indicators nested, in the form:
 
@@ -838,19 +1289,14 @@ def indicators_as_json(output_dir=OUTPUT_DIR):
         ]
     '''
 
-    out = []
-    indicators = get_all_indicators()
-    for indicator in [i for i in indicators if i['level'] == 1]:
-        indicator['children'] = get_nested_indicators(indicator, indicators)
-        out.append(indicator)
+    out = build_tree(get_all_indicators(build), indicator_parent_codes)
 
-    output_file = os.path.join(output_dir, 'indicators.json')
+    output_file = os.path.join(build.output_dir, 'indicators.json')
 
-    with open(output_file, 'w') as f:
-        f.write(json.dumps(out))
+    write_output(output_file, build.dumps(out), build.manifest)
 
 
-def themes_as_json(output_dir=OUTPUT_DIR):
+def themes_as_json(build):
     '''
     Write a JSON file with all themes nested, in the form:
 
@@ -883,51 +1329,49 @@ def themes_as_json(output_dir=OUTPUT_DIR):
         ]
     '''
 
-    out = []
-    themes = get_themes(include_indicators=True)
+    out = build_tree(get_themes(build, include_indicators=True),
+                     theme_parent_codes)
 
-    for theme in [i for i in themes if i['level'] == 1]:
-        theme['children'] = get_nested_themes(theme, themes)
-        out.append(theme)
+    output_file = os.path.join(build.output_dir, 'themes.json')
 
-    output_file = os.path.join(output_dir, 'themes.json')
+    write_output(output_file, build.dumps(out), build.manifest)
 
-    with open(output_file, 'w') as f:
-        f.write(json.dumps(out))
 
+def indicators_per_country_as_json(build, one_file=True):
 
-def indicators_per_country_as_json(one_file=True, output_dir=OUTPUT_DIR):
+    out = indicators_per_country(build, number_format=True)
+    for country_code, values in out.items():
+        out[country_code] = round_indicator_values(values)
 
-    out = indicators_per_country(number_format=True)
     if one_file:
-        output_file = os.path.join(output_dir, 'indicators_per_country.json')
+        output_file = os.path.join(build.output_dir,
+                                   'indicators_per_country.json')
 
-        with open(output_file, 'w') as f:
-            f.write(json.dumps(out))
+        write_output(output_file, build.dumps(out), build.manifest)
     else:
         for country_code in list(out.keys()):
-            output_file = os.path.join(output_dir,
+            output_file = os.path.join(build.output_dir,
                                        '{0}.json'.format(country_code))
 
-            with open(output_file, 'w') as f:
-                f.write(json.dumps(out[country_code]))
+            write_output(output_file, build.dumps(out[country_code]),
+                         build.manifest)
 
 
-def scores_per_country_as_json(output_dir=OUTPUT_DIR, random_values=False):
+def scores_per_country_as_json(build, random_values=False):
 
-    out = indicators_per_country(max_level=2, derived=False,
+    out = indicators_per_country(build, max_level=2, derived=False,
                                  random_values=random_values, number_format=True)
-    add_main_scores(out)
+    for country_code, values in out.items():
+        out[country_code] = round_indicator_values(values)
 
     file_name = ('scores_per_country.json' if not random_values
                  else 'scores_per_country_random.json')
-    output_file = os.path.join(output_dir, file_name)
+    output_file = os.path.join(build.output_dir, file_name)
 
-    with open(output_file, 'w') as f:
-        f.write(json.dumps(out))
+    write_output(output_file, build.dumps(out), build.manifest)
 
 
-def scores_per_country_as_csv(output_dir=OUTPUT_DIR, random_values=False, show_themes=True):
+def scores_per_country_as_csv(build, random_values=False, show_themes=True):
     '''
     Write a CSV file with the level 1 and 2 scores for each country, as well as
     the transversal themes, in the form:
@@ -939,10 +1383,11 @@ def scores_per_country_as_csv(output_dir=OUTPUT_DIR, random_values=False, show_t
 
     Note that transversal theme codes are prefixed with `t` to avoid conflicts
     '''
-    out = indicators_per_country(max_level=2, derived=False,
+    out = indicators_per_country(build, max_level=2, derived=False,
                                  random_values=random_values)
     if show_themes:
-        themes = themes_per_country(prefix='t', random_values=random_values)
+        themes = themes_per_country(build, prefix='t',
+                                    random_values=random_values)
 
     out_list = []
     for country in list(out.keys()):
@@ -957,15 +1402,17 @@ def scores_per_country_as_csv(output_dir=OUTPUT_DIR, random_values=False, show_t
 
     file_name = ('scores_per_country.csv' if not random_values
                  else 'scores_per_country_random.csv')
-    output_file = os.path.join(output_dir, file_name)
+    output_file = os.path.join(build.output_dir, file_name)
 
-    with open(output_file, 'w') as f:
-        w = csv.DictWriter(f, list(out_list[0].keys()))
-        w.writeheader()
-        w.writerows(out_list)
+    f = io.StringIO()
+    w = csv.DictWriter(f, list(out_list[0].keys()))
+    w.writeheader()
+    w.writerows(out_list)
+
+    write_output(output_file, f.getvalue(), build.manifest)
 
 
-def c3_ready_json(output_dir=OUTPUT_DIR, random_values=False, show_themes=True):
+def c3_ready_json(build, random_values=False, show_themes=True):
     '''
     Writes a C3 optimized JSON file to display the country bar charts.
 
@@ -1004,9 +1451,12 @@ def c3_ready_json(output_dir=OUTPUT_DIR, random_values=False, show_themes=True):
     ]
     '''
 
-    indicators = indicators_per_country(max_level=2, derived=False,
+    indicators = indicators_per_country(build, max_level=2, derived=False,
                                         random_values=random_values)
 
+    if show_themes:
+        themes = themes_per_country(build, prefix='t',
+                                    random_values=random_values)
 
     out = []
     for country_code, values in indicators.items():
@@ -1044,12 +1494,14 @@ def c3_ready_json(output_dir=OUTPUT_DIR, random_values=False, show_themes=True):
 
         # Add Transversal themes
         if show_themes:
-            themes = themes_per_country(prefix='t', random_values=random_values)
             item.update(themes[country_code])
 
         # Add main index
         item['index'] = values['index']
 
+        for code, value in item.items():
+            item[code] = round_value(value, C3_PRECISION)
+
         # Add country name
         item['name'] = get_country_name(country_code)
 
@@ -1057,13 +1509,12 @@ def c3_ready_json(output_dir=OUTPUT_DIR, random_values=False, show_themes=True):
 
     file_name = ('c3_scores_per_country.json' if not random_values
                  else 'c3_scores_per_country_random.json')
-    output_file = os.path.join(output_dir, file_name)
+    output_file = os.path.join(build.output_dir, file_name)
 
-    with open(output_file, 'w') as f:
-        f.write(json.dumps(out))
+    write_output(output_file, build.dumps(out), build.manifest)
 
 
-def translation_strings():
+def translation_strings(build):
     '''
     Outputs all translatable strings in a python module wrapped in the gettext
     function (_), so they can be compiled to the i18n *.po files, eg:
@@ -1078,9 +1529,9 @@ def translation_strings():
 
     The output file is always `rtei/translation_strings.py`
     '''
-    indicators = get_indicators()
-    themes = get_themes()
-    responses = indicators_per_country()
+    indicators = get_indicators(build)
+    themes = get_themes(build)
+    responses = indicators_per_country(build)
 
     output_file = os.path.join(os.path.dirname(__file__), 'rtei',
                                'translation_strings.py')
@@ -1123,18 +1574,191 @@ def translation_strings():
         f.write('\n'.join(out))
 
 
-def countries_with_data(output_dir=OUTPUT_DIR):
+def countries_with_data(build):
 
-    data_available = indicators_per_country(max_level=2, derived=False)
+    data_available = indicators_per_country(build, max_level=2, derived=False)
 
     out = {}
     for country_code in list(data_available.keys()):
         out[country_code] = get_country_name(country_code)
 
-    output_file = os.path.join(output_dir, 'countries_with_data.json')
+    output_file = os.path.join(build.output_dir, 'countries_with_data.json')
 
-    with open(output_file, 'w') as f:
-        f.write(json.dumps(out))
+    write_output(output_file, build.dumps(out), build.manifest)
+
+
+# Output type -> function that writes it
+OUTPUTS = OrderedDict([
+    ('indicators-json', indicators_as_json),
+    ('themes-json', themes_as_json),
+    ('indicators-csv', indicators_as_csv),
+    ('scores-per-country-json', scores_per_country_as_json),
+    ('scores-per-country-csv', scores_per_country_as_csv),
+    ('indicators-per-country', indicators_per_country_as_json),
+    ('c3-ready-json', c3_ready_json),
+    ('countries-with-data', countries_with_data),
+])
+
+
+def get_output_sheets(name, options):
+    '''
+    Returns the workbook sheets needed to build the output `name` with the
+    provided options.
+    '''
+    if name == 'themes-json':
+        return [THEMES_SHEET]
+    elif options.get('show_themes'):
+        return [CORE_SHEET, THEMES_SHEET]
+    return [CORE_SHEET]
+
+
+def get_steps(output_type, random_values=False, show_themes=True):
+    '''
+    Returns a list of `(output type, options)` tuples with the outputs that
+    need to be built for the requested output type (which can be `all`).
+    '''
+    options = {
+        'indicators-json': {},
+        'themes-json': {},
+        'indicators-csv': {},
+        'scores-per-country-json': {'random_values': random_values},
+        'scores-per-country-csv': {'random_values': random_values,
+                                   'show_themes': show_themes},
+        'indicators-per-country': {'one_file': False},
+        'c3-ready-json': {'random_values': random_values,
+                          'show_themes': show_themes},
+        'countries-with-data': {},
+    }
+
+    if output_type == 'all':
+        steps = [
+            ('indicators-json', {}),
+            ('themes-json', {}),
+            ('indicators-per-country', {'one_file': False}),
+            ('scores-per-country-json', {'random_values': random_values}),
+            ('c3-ready-json', {'show_themes': show_themes}),
+            ('countries-with-data', {}),
+        ]
+        if not show_themes:
+            steps = [step for step in steps if step[0] != 'themes-json']
+        return steps
+
+    return [(output_type, options[output_type])]
+
+
+def build_outputs(input_file, output_dir, steps, force=False, compact=True):
+    '''
+    Builds the outputs in `steps` (see `get_steps`) for a workbook, skipping
+    the ones that are up to date unless `force` is True, and the ones that
+    need sheets the workbook doesn't have (eg older workbooks with a
+    different layout). Outputs that include the cross-cutting themes are
+    built without them if the workbook has no THEMES_SHEET.
+
+    Returns a list with the names of the outputs built.
+    '''
+    build = DataBuild(input_file, output_dir, compact=compact)
+
+    built = []
+    checked = []
+    for name, options in steps:
+        missing = [sheet for sheet in get_output_sheets(name, options)
+                   if sheet not in build.sheet_names]
+        if missing == [THEMES_SHEET] and options.get('show_themes'):
+            # Workbooks without cross-cutting themes (eg 2021)
+            print('No {0} sheet on {1}, building {2} without themes'.format(
+                THEMES_SHEET, input_file, name))
+            options = dict(options, show_themes=False)
+        elif missing:
+            print('Skipping {0}, no {1} sheet on {2}'.format(
+                name, ', '.join(missing), input_file))
+            continue
+
+        checked.append(name)
+        if run_output(build, name, OUTPUTS[name], force=force, **options):
+            built.append(name)
+
+    # Don't write a manifest if the workbook can't build any of the outputs
+    if checked:
+        build.manifest.save()
+
+    return built
+
+
+def get_default_years():
+    '''
+    Returns the years defined in `settings.YEARS`, or the ones with a workbook
+    available if the Django settings can not be imported.
+    '''
+    try:
+        from rtei.settings.base import YEARS
+    except ImportError:
+        pattern = INPUT_FILE_PATTERN.replace('{year}', '*')
+        prefix, suffix = pattern.split('*')
+        YEARS = sorted(path[len(prefix):-len(suffix)]
+                       for path in glob.glob(pattern))
+    return list(YEARS)
+
+
+def build_year(year, steps, force=False, compact=True):
+    '''
+    Builds the outputs in `steps` for a year (see `build_outputs`).
+
+    The outputs are written to a copy of the year output dir, which only
+    replaces it once all outputs have been built, so a failed build leaves the
+    existing files and manifest untouched.
+    '''
+    output_dir = OUTPUT_DIR_PATTERN.format(year=year)
+    staging_root = tempfile.mkdtemp(
+        prefix='.build-{0}-'.format(year),
+        dir=os.path.dirname(os.path.abspath(output_dir)))
+    try:
+        staging_dir = os.path.join(staging_root, 'new')
+        if os.path.exists(output_dir):
+            shutil.copytree(output_dir, staging_dir)
+        else:
+            os.makedirs(staging_dir)
+
+        built = build_outputs(INPUT_FILE_PATTERN.format(year=year),
+                              staging_dir, steps, force, compact)
+
+        if os.path.exists(output_dir):
+            os.rename(output_dir, os.path.join(staging_root, 'old'))
+        os.rename(staging_dir, output_dir)
+    finally:
+        shutil.rmtree(staging_root, ignore_errors=True)
+
+    return built
+
+
+def build_years(years, steps, force=False, processes=None, compact=True):
+    '''
+    Builds the outputs in `steps` for each of the years provided, each one in
+    its own process (so each worker only holds one workbook).
+
+    Input files and output dirs are taken from INPUT_FILE_PATTERN and
+    OUTPUT_DIR_PATTERN. See `build_year`.
+
+    Returns a list with the years that could not be built.
+    '''
+    failed = []
+    processes = processes or min(len(years), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        jobs = OrderedDict()
+        for year in years:
+            jobs[year] = executor.submit(
+                build_year, year, steps, force, compact)
+
+        for year, job in jobs.items():
+            try:
+                built = job.result()
+            except Exception as e:
+                print('Error building data for {0}: {1!r}'.format(year, e))
+                failed.append(year)
+            else:
+                print('Built data for {0} ({1} outputs updated)'.format(
+                    year, len(built)))
+
+    return failed
 
 
 if __name__ == '__main__':
@@ -1150,6 +1774,26 @@ at `data/rtei_data_2015.xlsx` but you can provide a different location with the
 The outputs are JSON files, by default created on the `rtei/static/data`
 folder. You can change the destination folder with the `-o` flag.
 
+The hashes of the inputs and generated files are recorded in a
+`build_manifest.json` file on the destination folder. Outputs are skipped if
+the workbook, `data/countries.json` and this script have not changed since
+they were last built, and files are only rewritten if their contents changed.
+Use the `-f` flag to build everything again.
+
+Numeric values are rounded to the precision the site displays (see
+OUTPUT_PRECISION) and the JSON is written without whitespace. Use the
+`--no-compact` flag to get the default JSON separators.
+
+To build the data for several years at once, pass them with the `-y` flag
+(or no years to build all of `settings.YEARS`). Each year is built in its own
+process, reading `rtei/static/data/rtei_data_{year}.xlsx` and writing to
+`rtei/static/data/{year}`. The files of a year are only replaced if all of
+its outputs could be built.
+
+Outputs that need sheets the workbook doesn't have are skipped, and if there
+is no cross-cutting themes sheet the rest of outputs are built without themes
+(as with `--no-themes`).
+
 The available outputs are:
 
     * `indicators-json`
@@ -1179,6 +1823,23 @@ The available outputs are:
     parser.add_argument('--no-themes',
                         action='store_true',
                         help='Don\'t process cross-cutting themes')
+    parser.add_argument('-f', '--force',
+                        action='store_true',
+                        help='Build all outputs, even if their inputs have '
+                             'not changed since the last build')
+    parser.add_argument('--no-compact',
+                        action='store_true',
+                        help='Write the JSON outputs with the default '
+                             'separators')
+    parser.add_argument('-y', '--years',
+                        nargs='*',
+                        help='Build the data for these years in parallel '
+                             '(all years in settings.YEARS if no years are '
+                             'provided), ignoring -i and -o')
+    parser.add_argument('-j', '--processes',
+                        type=int,
+                        help='Number of processes to use with -y (defaults '
+                             'to one per year, up to the number of CPUs)')
 
     args = parser.parse_args()
 
@@ -1186,35 +1847,20 @@ The available outputs are:
     output_dir = args.output or OUTPUT_DIR
     no_themes = args.no_themes
 
-    wb = load_workbook(input_file, data_only=True)
-
-    with open(COUNTRIES_FILE, 'r') as f:
-        countries = json.load(f)
-    if args.type == 'all':
-        indicators_as_json(output_dir)
-        if not no_themes:
-            themes_as_json(output_dir)
-        indicators_per_country_as_json(one_file=False, output_dir=output_dir)
-        scores_per_country_as_json(output_dir, random_values=args.random)
-        c3_ready_json(output_dir=output_dir, show_themes=not no_themes)
-        countries_with_data(output_dir=output_dir)
-    elif args.type == 'indicators-json':
-        indicators_as_json(output_dir)
-    elif args.type == 'themes-json':
-        themes_as_json(output_dir)
-    elif args.type == 'indicators-csv':
-        indicators_as_csv(output_dir)
-    elif args.type == 'scores-per-country-json':
-        scores_per_country_as_json(output_dir, random_values=args.random)
-    elif args.type == 'scores-per-country-csv':
-        scores_per_country_as_csv(output_dir, random_values=args.random, show_themes=not no_themes)
-    elif args.type == 'indicators-per-country':
-        indicators_per_country_as_json(one_file=False, output_dir=output_dir)
-    elif args.type == 'c3-ready-json':
-        c3_ready_json(output_dir=output_dir, random_values=args.random, show_themes=not no_themes)
-    elif args.type == 'countries-with-data':
-        countries_with_data(output_dir=output_dir)
-    elif args.type == 'translation-strings':
-        translation_strings()
-    else:
+    if args.type == 'translation-strings':
+        translation_strings(DataBuild(input_file, output_dir,
+                                      compact=not args.no_compact))
+    elif args.type != 'all' and args.type not in OUTPUTS:
         print('Unknown output type')
+    else:
+        steps = get_steps(args.type, random_values=args.random,
+                          show_themes=not no_themes)
+        if args.years is not None:
+            failed = build_years(args.years or get_default_years(), steps,
+                                 force=args.force, processes=args.processes,
+                                 compact=not args.no_compact)
+            if failed:
+                sys.exit(1)
+        else:
+            build_outputs(input_file, output_dir, steps, force=args.force,
+                          compact=not args.no_compact)
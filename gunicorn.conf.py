@@ -0,0 +1,20 @@
+'''
+gunicorn settings, see the `Procfile`.
+'''
+import gc
+
+
+# Load the app in the master process, so the data loaded by `on_starting` is
+# shared by all workers
+preload_app = True
+
+
+def on_starting(server):
+    from rtei.data import preload
+
+    preload()
+
+    if hasattr(gc, 'freeze'):
+        # Keep the garbage collector from touching (and so copying) the
+        # preloaded objects on the workers (Python 3.7+)
+        gc.freeze()
@@ -0,0 +1,98 @@
+'''
+Helpers to nest the flat lists of indicators and themes into trees, based on
+their codes and levels.
+'''
+from collections import OrderedDict
+
+
+def indicator_parent_codes(code):
+    '''
+    Returns the codes that could be parents of an indicator, ie all its
+    prefixes (eg 1.1.1a -> 1, 1., 1.1, 1.1., 1.1.1, 1.1.1a).
+    '''
+    return [code[:i] for i in range(1, len(code) + 1)]
+
+
+def theme_parent_codes(code):
+    '''
+    Returns the codes that could be parents of a theme, ie the numeric part
+    of its code (eg 1A.A -> 1).
+    '''
+    return [''.join(c for c in code if c.isdigit())]
+
+
+def build_tree(nodes, parent_codes, max_level=4):
+    '''
+    Nests a flat list of nodes (dicts with at least `code` and `level` keys)
+    and returns the list of level 1 nodes.
+
+    A node is a child of any node one level above whose code is one of
+    `parent_codes(code)`. Children are added to a `children` key in the same
+    order they have on the flat list. Level 1 nodes always get a `children`
+    key, other nodes only if they have any. Nodes on `max_level` don't get
+    children, and nodes that can't be reached from a level 1 node are left
+    out.
+
+    Note that the passed nodes are modified.
+    '''
+    index = dict((node['code'], node) for node in nodes)
+
+    children = {}
+    for node in nodes:
+        for code in parent_codes(node['code']):
+            parent = index.get(code)
+            if (parent and parent['level'] == node['level'] - 1 and
+                    parent['level'] < max_level):
+                children.setdefault(id(parent), []).append(node)
+
+    roots = [node for node in nodes if node['level'] == 1]
+
+    # Only nodes reachable from the roots get their children assigned
+    pending = list(roots)
+    done = set()
+    while pending:
+        node = pending.pop()
+        if id(node) in done:
+            continue
+        done.add(id(node))
+        node_children = children.get(id(node), [])
+        if node_children or node['level'] == 1:
+            node['children'] = node_children
+        pending.extend(node_children)
+
+    return roots
+
+
+def index_tree(nodes):
+    '''
+    Given a list of nested nodes (like the ones returned by `build_tree` or
+    stored in `indicators.json` and `themes.json`), returns a dict with all
+    nodes in the tree keyed by code, in depth-first order.
+
+    If a code appears more than once, the first node found is kept.
+    '''
+    index = OrderedDict()
+    pending = list(reversed(nodes))
+    while pending:
+        node = pending.pop()
+        index.setdefault(node['code'], node)
+        pending.extend(reversed(node.get('children', [])))
+    return index
+
+
+def flatten_tree(nodes):
+    '''
+    Given a list of nested nodes, returns a list of `(depth, node)` tuples
+    with all nodes in the tree in depth-first order, where `depth` is 0 for
+    the nodes on `nodes`, 1 for their children, etc.
+
+    This allows walking the tree (eg to render it) without recursion.
+    '''
+    out = []
+    pending = [(0, node) for node in reversed(nodes)]
+    while pending:
+        depth, node = pending.pop()
+        out.append((depth, node))
+        pending.extend((depth + 1, child)
+                       for child in reversed(node.get('children') or []))
+    return out
@@ -0,0 +1,98 @@
+'''
+Lookup index for the countries defined in `data/countries.json`.
+
+This is used both by the site and by the `build_data.py` script, so it must
+not depend on Django.
+'''
+import os
+import json
+import unicodedata
+
+
+COUNTRIES_FILE = os.path.join(os.path.dirname(__file__),
+                              '..', 'data', 'countries.json')
+
+_country_index = None
+
+
+def normalize_name(name):
+    '''
+    Returns a version of a country name suitable for lookups: lowercase,
+    without accents and with single spaces, eg 'Côte  d'Ivoire' ->
+    'cote d'ivoire'.
+    '''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.lower().split())
+
+
+class CountryIndex(object):
+    '''
+    Maps country names (including the alternative ones in `other_names`) and
+    ISO codes to the country records, eg:
+
+        {
+            'iso2': 'GB',
+            'iso3': 'GBR',
+            'name': 'United Kingdom',
+            'other_names': ['UK']
+        }
+
+    If more than one country has the same name or code, the first one wins.
+    '''
+
+    def __init__(self, countries):
+        self.countries = countries
+
+        self.by_name = {}
+        self.by_iso2 = {}
+        self.by_iso3 = {}
+
+        for code, country in countries.items():
+            for name in [country['name']] + country.get('other_names', []):
+                self.by_name.setdefault(normalize_name(name), country)
+            if country.get('iso2'):
+                self.by_iso2.setdefault(country['iso2'].upper(), country)
+            if country.get('iso3'):
+                self.by_iso3.setdefault(country['iso3'].upper(), country)
+
+    def get(self, country_code):
+        '''
+        Given a 2 or 3 digit ISO code, return the country record.
+        '''
+        if not country_code:
+            return None
+        if len(country_code) == 3:
+            return self.by_iso3.get(country_code.upper())
+        return self.by_iso2.get(country_code.upper())
+
+    def get_country_code(self, country_name, code_type='iso2'):
+        '''
+        Given a country name, return its ISO code
+
+        By default to the 2 digit code is returned (eg 'AF' for Afghanistan),
+        passing code_type='iso3' will return the 3 digit code (eg'AFG').
+        '''
+        if not country_name:
+            return None
+        country = self.by_name.get(normalize_name(country_name))
+        return country[code_type] if country else None
+
+    def get_country_name(self, country_code):
+        '''
+        Given a country code, return the corresponding country name.
+        '''
+        country = self.get(country_code)
+        return country['name'] if country else None
+
+
+def get_country_index():
+    '''
+    Returns the `CountryIndex` for `data/countries.json`, which is only built
+    once per process.
+    '''
+    global _country_index
+    if _country_index is None:
+        with open(COUNTRIES_FILE, 'r') as f:
+            _country_index = CountryIndex(json.load(f))
+    return _country_index
@@ -1,25 +1,190 @@
+import hashlib
 import json
+import logging
 import os
+import resource
+import sys
+import threading
+import time
 
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from django.conf import settings
+from django.utils import translation
 
-_file_cache = {}
+from rtei.code_tree import flatten_tree, index_tree
+from rtei.countries import get_country_index, normalize_name
+from rtei.indicator_values import IndicatorSchema
 
+try:
+    import icu
+except ImportError:
+    icu = None
+
+log = logging.getLogger(__name__)
+
+# Defaults for `settings.DATA_CACHE_MAX_BYTES` and
+# `settings.DATA_CACHE_CHECK_INTERVAL`
+DEFAULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_CACHE_CHECK_INTERVAL = 1
+
+# Written by build_data.py on each year folder
+MANIFEST_FILE = 'build_manifest.json'
 
-def get_json_file(path, ordered_dict=True):
-    if _file_cache.get(path):
-        return _file_cache[path]
 
+CacheEntry = namedtuple(
+    'CacheEntry', ['value', 'file_stat', 'size', 'memory', 'derived'])
+
+
+def get_file_stat(path):
+    '''
+    Returns what is used to detect that a file changed: its modification
+    time, size and inode (files are replaced when rebuilt by build_data.py).
+    '''
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def get_memory_size(value):
+    '''
+    Returns the approximate memory used by a parsed JSON value, in bytes.
+    Objects shared by different parts of the value are only counted once.
+    '''
+    size = 0
+    seen = set()
+    pending = [value]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            pending.extend(item)
+    return size
+
+
+def load_json_file(path, ordered_dict=True):
     with open(path) as f:
         if ordered_dict:
-            out = json.load(f, object_pairs_hook=OrderedDict)
-        else:
-            out = json.load(f)
+            return json.load(f, object_pairs_hook=OrderedDict)
+        return json.load(f)
 
-    _file_cache[path] = out
 
-    return out
+class FileCache(object):
+    '''
+    LRU cache for the parsed data files, keyed by path.
+
+    Entries are invalidated when the file changes on disk (eg after running
+    build_data.py), which is checked at most once every `check_interval`
+    seconds for each file. The least recently used ones are dropped when the
+    memory used by all of them goes over `max_bytes`. Files bigger than
+    `max_bytes` are not cached at all.
+
+    Values derived from a file (eg indexes) can be stored along with it with
+    `get_derived`, so they are dropped at the same time.
+    '''
+
+    def __init__(self, max_bytes, check_interval=0):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.checked = {}
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get_entry(self, path, ordered_dict=True, check=False):
+        '''
+        Returns the `CacheEntry` for a file. Pass `check=True` to check if
+        the file changed even if it was checked less than `check_interval`
+        seconds ago.
+        '''
+        key = (path, ordered_dict)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is not None and not check and
+                    now - self.checked[key] < self.check_interval):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        file_stat = get_file_stat(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.file_stat == file_stat:
+                self.checked[key] = now
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        value = load_json_file(path, ordered_dict)
+
+        entry = CacheEntry(value, file_stat, file_stat[1],
+                           get_memory_size(value), {})
+        with self.lock:
+            self.discard(key)
+            if entry.memory <= self.max_bytes:
+                self.entries[key] = entry
+                self.checked[key] = now
+                self.memory += entry.memory
+                while self.memory > self.max_bytes:
+                    self.discard(next(iter(self.entries)))
+                    self.evictions += 1
+        return entry
+
+    def get(self, path, ordered_dict=True, check=False):
+        return self.get_entry(path, ordered_dict, check).value
+
+    def get_derived(self, path, name, func, ordered_dict=True):
+        '''
+        Returns `func(value)` for the contents of `path`, computing it only
+        once for each version of the file.
+        '''
+        entry = self.get_entry(path, ordered_dict)
+        if name not in entry.derived:
+            entry.derived[name] = func(entry.value)
+        return entry.derived[name]
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            del self.checked[key]
+            self.memory -= entry.memory
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked.clear()
+            self.memory = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': sum(e.size for e in self.entries.values()),
+                'memory': self.memory,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_file_cache = FileCache(
+    getattr(settings, 'DATA_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES),
+    getattr(settings, 'DATA_CACHE_CHECK_INTERVAL',
+            DEFAULT_CACHE_CHECK_INTERVAL))
+
+
+def get_json_file(path, ordered_dict=True):
+    return _file_cache.get(path, ordered_dict)
 
 
 def get_file_path(file_name, year=''):
@@ -30,14 +195,41 @@ def get_file_path(file_name, year=''):
         file_name)
 
 
-def get_indicators(year):
-    indicators_file = get_file_path('indicators.json', year)
-    return get_json_file(indicators_file, ordered_dict=False)
+def get_manifest_version(manifest):
+    '''
+    Returns a hash of the files recorded on a build manifest.
+    '''
+    files = json.dumps(manifest.get('files', {}), sort_keys=True)
+    return hashlib.sha256(files.encode('utf-8')).hexdigest()
 
 
-def get_themes(year):
-    themes_file = get_file_path('themes.json', year)
-    return get_json_file(themes_file, ordered_dict=False)
+def get_data_version(year):
+    '''
+    Returns a string that changes every time the data files for a year are
+    rebuilt, to be used in cache keys.
+
+    This is a hash of the files on the build manifest, or if there isn't one,
+    the modification time of the year folder (build_data.py replaces files
+    rather than writing them in place, which updates it).
+    '''
+    manifest_file = get_file_path(MANIFEST_FILE, year)
+    if os.path.exists(manifest_file):
+        return _file_cache.get_derived(manifest_file, 'version',
+                                       get_manifest_version)
+
+    return str(os.stat(get_file_path('', year)).st_mtime_ns)
+
+
+def get_data_modified(year):
+    '''
+    Returns the time (as a timestamp) the data files for a year were last
+    rebuilt, ie the modification time of the build manifest or, if there
+    isn't one, of the year folder.
+    '''
+    manifest_file = get_file_path(MANIFEST_FILE, year)
+    if os.path.exists(manifest_file):
+        return os.stat(manifest_file).st_mtime
+    return os.stat(get_file_path('', year)).st_mtime
 
 
 def get_countries():
@@ -46,39 +238,355 @@ def get_countries():
     return get_json_file(countries_file)
 
 
-def get_scores_per_country(year):
-    scores_file = get_file_path('scores_per_country.json', year)
-    return get_json_file(scores_file)
+def index_c3_scores(rows):
+    '''
+    Given the rows of `c3_scores_per_country.json`, which only have the
+    country name, returns them keyed by ISO2 code.
+    '''
+    country_index = get_country_index()
+    out = {}
+    for row in rows:
+        country_code = country_index.get_country_code(row['name'])
+        if country_code:
+            out.setdefault(country_code, row)
+    return out
+
+
+def get_collation_key(language):
+    '''
+    Returns a function that gives the key to sort names in a language, using
+    the ICU collation rules if PyICU is installed. Otherwise names are just
+    compared without accents or case (see `normalize_name`).
+    '''
+    if icu is not None and language:
+        return icu.Collator.createInstance(icu.Locale(language)).getSortKey
+    return normalize_name
+
+
+def sort_countries(scores, language=None):
+    '''
+    Given the contents of `scores_per_country.json`, returns a dict with the
+    names of the countries keyed by ISO2 code, sorted by name as appropriate
+    for `language`.
+    '''
+    collation_key = get_collation_key(language)
+    return OrderedDict(sorted(
+        [(code, get_country_name(code)) for code in scores],
+        key=lambda t: collation_key(t[1])))
+
+
+def get_display_value(value, level):
+    '''
+    Returns an indicator value as displayed on the site for the active
+    language: strings are translated and numbers rounded to the precision
+    of the indicator level (only for indicators that have one).
+    '''
+    if isinstance(value, str):
+        return translation.ugettext(value)
+    return round_display_value(value, level)
+
+
+def round_display_value(value, level):
+    '''
+    Rounds a numeric indicator value as displayed on the site (see
+    `get_display_value`). Other values are returned as they are.
+    '''
+    if value and level and not isinstance(value, str):
+        if level < 3:
+            value = int(round(value))
+        else:
+            value = round(value, 2)
+    return value
+
+
+class DisplayValues(object):
+    '''
+    The values of a country as displayed on the indicator trees in a
+    language, keyed by the code and level of each node of the trees (see
+    `YearDataset.get_display_values`).
+
+    The rounded values are shared by all languages, and strings are
+    translated when they are looked up.
+    '''
+    __slots__ = ('index', 'values', 'strings')
+
+    def __init__(self, index, values, strings):
+        self.index = index
+        self.values = values
+        self.strings = strings
+
+    def get(self, key, default=None):
+        position = self.index.get(key)
+        if position is None:
+            return default
+        value = self.values[position]
+        if isinstance(value, str):
+            return self.strings.get(value, value)
+        return value
+
+
+class YearDataset(object):
+    '''
+    All the data files of a year used by the site, as they were on a version
+    of the data (see `get_data_version`), along with their indexes.
+
+    The values of each country are stored as `CountryValues` objects sharing
+    the same `IndicatorSchema`, rather than as dicts. Their data files are not
+    kept on the file cache.
+
+    Everything is loaded when the dataset is created and it is not modified
+    afterwards, so it can be shared between threads (and by the gunicorn
+    workers, see `preload`), and code that holds a dataset keeps getting the
+    same data after a new one is built for the year. Use `get_dataset` to get
+    the current one.
+    '''
+
+    def __init__(self, year, version):
+        self.year = year
+        self.version = version
+        self.modified = get_data_modified(year)
+
+        self.indicators = self.load('indicators.json', ordered_dict=False)
+        self.themes = self.load('themes.json', ordered_dict=False)
+        self.scores = self.load('scores_per_country.json')
+        self.c3_scores = self.load('c3_scores_per_country.json')
+        # Older years don't have this one
+        self.countries_with_data = self.load('countries_with_data.json',
+                                             required=False)
+
+        self.indicators_index = index_tree(self.indicators)
+        self.c3_scores_by_country = index_c3_scores(self.c3_scores)
+
+        # Flattened trees for the indicator lists of the pages, the main one
+        # and one for each subtheme, as `(subtheme_code, rows)` tuples
+        self.indicator_rows = flatten_tree(self.indicators)
+        self.theme_indicator_rows = [
+            (subtheme['code'], flatten_tree(subtheme.get('indicators', [])))
+            for theme in self.themes
+            for subtheme in theme.get('children', [])]
+
+        # Position of the display values (see `get_display_values`) of each
+        # node of the trees, keyed by its code and level
+        self.display_index = {}
+        for rows in [self.indicator_rows] + [
+                rows for code, rows in self.theme_indicator_rows]:
+            for depth, node in rows:
+                self.display_index.setdefault(
+                    (node.get('code', ''), node.get('level')),
+                    len(self.display_index))
+
+        country_codes = set(self.scores)
+        if self.countries_with_data:
+            country_codes.update(self.countries_with_data)
+        self.schema = IndicatorSchema(self.indicators_index)
+        self.countries = {}
+        for country_code in sorted(country_codes):
+            values = self.load('{0}.json'.format(country_code),
+                               required=False, cache=False)
+            if values is not None:
+                self.countries[country_code] = self.schema.add_country(values)
+        self.country_codes = frozenset(self.countries)
+
+        # Rounded values of each country for the nodes of `display_index`,
+        # with equal numbers shared by all countries, and the translations
+        # of their strings for each language
+        numbers = {}
+        self.display_values = {}
+        for country_code, values in self.countries.items():
+            display_values = [None] * len(self.display_index)
+            for (code, level), position in self.display_index.items():
+                value = round_display_value(values.get(code, ''), level)
+                display_values[position] = numbers.setdefault(
+                    (type(value), value), value)
+            self.display_values[country_code] = tuple(display_values)
+        strings = set(value for value in numbers.values()
+                      if isinstance(value, str))
+        self.display_strings = {}
+        for language, name in settings.LANGUAGES:
+            with translation.override(language):
+                self.display_strings[language] = dict(
+                    (string, translation.ugettext(string))
+                    for string in strings)
+
+        self.sorted_countries = dict(
+            (language, sort_countries(self.scores, language))
+            for language, name in settings.LANGUAGES)
+
+    def load(self, file_name, ordered_dict=True, required=True, cache=True):
+        '''
+        Loads a data file of the year, checking that the cached one is up to
+        date (or skipping the cache if `cache` is False). Returns None if the
+        file doesn't exist and is not `required`.
+        '''
+        path = get_file_path(file_name, self.year)
+        try:
+            if not cache:
+                return load_json_file(path, ordered_dict)
+            return _file_cache.get(path, ordered_dict, check=True)
+        except FileNotFoundError:
+            if required:
+                raise
+            return None
 
+    def get_available_countries(self, language):
+        if language not in self.sorted_countries:
+            return sort_countries(self.scores, language)
+        return self.sorted_countries[language]
 
-def get_c3_scores_per_country(year):
-    scores_file = get_file_path('c3_scores_per_country.json', year)
-    return get_json_file(scores_file)
+    def get_display_values(self, country_code, language):
+        '''
+        Returns the values of a country as displayed on the indicator trees
+        (see `get_display_value`) in `language`, as a `DisplayValues` object.
 
+        They are computed when the dataset is loaded, for all languages.
+        `language` must be the active one.
+        '''
+        strings = self.display_strings.get(language)
+        if strings is None:
+            # All tables have the same strings
+            strings = dict(
+                (string, translation.ugettext(string))
+                for string in next(iter(self.display_strings.values()), ()))
+        return DisplayValues(self.display_index,
+                             self.display_values[country_code], strings)
 
-def get_indicators_for_country(country_code, year):
-    country_file = get_file_path('{0}.json'.format(country_code), year)
-    if not os.path.exists(country_file):
-        return None
+    def get_memory_size(self):
+        '''
+        Returns the approximate memory used by the data files and the display
+        values, in bytes (see `get_memory_size`). Other indexes are not
+        included.
+        '''
+        return (get_memory_size([
+            self.indicators, self.themes, self.scores, self.c3_scores,
+            self.countries_with_data, self.schema.codes, self.schema.slots,
+            self.schema.objects, self.display_index, self.display_values,
+            self.display_strings]) +
+            sum(sys.getsizeof(values) for values in self.countries.values()))
 
-    return get_json_file(country_file)
+
+# Current `YearDataset` of each year, along with the time its version was
+# last checked. Entries are only ever replaced as a whole.
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def get_dataset(year):
+    '''
+    Returns the current `YearDataset` for a year.
+
+    The data version is checked at most once every
+    `DATA_CACHE_CHECK_INTERVAL` seconds, and if it changed (eg a new build
+    manifest was published) a new dataset is loaded and replaces the old one.
+    Only one thread loads it, the others keep getting the old dataset until
+    it's ready. If loading it fails the old dataset is kept (the error is
+    only raised if there is none).
+
+    Requests should get the dataset once and use it for everything they
+    need, so they have a consistent view of the data even if it is replaced
+    in the meantime.
+    '''
+    current = _datasets.get(year)
+    now = time.time()
+    if current and now - current[1] < _file_cache.check_interval:
+        return current[0]
+
+    # Block only if there is no dataset for the year yet
+    if not _datasets_lock.acquire(blocking=current is None):
+        return current[0]
+    try:
+        current = _datasets.get(year)
+        if current and now - current[1] < _file_cache.check_interval:
+            return current[0]
+        try:
+            version = get_data_version(year)
+            if current and current[0].version == version:
+                dataset = current[0]
+            else:
+                dataset = YearDataset(year, version)
+                if current:
+                    log.info('Loaded new data for {0} (version {1})'.format(
+                        year, version))
+        except Exception:
+            if current is None:
+                raise
+            # Eg files half copied or a broken build. Keep serving the
+            # current data, and try again after the check interval
+            log.exception('Could not load new data for {0}, keeping version '
+                          '{1}'.format(year, current[0].version))
+            dataset = current[0]
+        _datasets[year] = (dataset, now)
+        return dataset
+    finally:
+        _datasets_lock.release()
+
+
+def get_indicators(year):
+    return get_dataset(year).indicators
+
+
+def get_themes(year):
+    return get_dataset(year).themes
+
+
+def get_available_country_codes(year):
+    '''
+    Returns a set with the codes of the countries that have a data file for a
+    year.
+    '''
+    return get_dataset(year).country_codes
 
 
 def get_countries_with_data():
-    year = settings.YEARS[-1]
-    scores_file = get_file_path('countries_with_data.json', year)
-    return get_json_file(scores_file)
+    return get_dataset(settings.YEARS[-1]).countries_with_data
 
 
 def get_country_name(country_code):
     '''
     Given a country code, return the corresponding country name.
     '''
-    code_type = 'iso2'
-    if len(country_code) == 3:
-        code_type = 'iso3'
+    return get_country_index().get_country_name(country_code)
+
+
+def preload(years=None):
+    '''
+    Loads the datasets (see `YearDataset`) for the provided years (all of
+    `settings.YEARS` by default).
+
+    This is called by gunicorn before forking the workers (see
+    `gunicorn.conf.py`), so they share the parsed data instead of each one
+    parsing it on its first requests.
+
+    Returns a dict with the number of files loaded, the seconds it took and
+    the memory used, as estimated by the datasets and as the increase in the
+    process max RSS (both in bytes).
+    '''
+    years = years or settings.YEARS
+
+    start = time.time()
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_stats = _file_cache.stats()
+
+    get_countries()
+    datasets = [get_dataset(year) for year in years]
 
-    return next(
-        (c['name'] for code, c in get_countries().items()
-         if c[code_type] == country_code.upper()),
-        None)
+    stats = _file_cache.stats()
+    out = {
+        'years': list(years),
+        # Country files are not loaded through the cache
+        'files': (stats['misses'] - start_stats['misses'] +
+                  sum(len(dataset.countries) for dataset in datasets)),
+        'seconds': time.time() - start,
+        'memory': sum(dataset.get_memory_size() for dataset in datasets),
+        # ru_maxrss is in kilobytes on Linux
+        'rss': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss -
+                start_rss) * 1024,
+    }
+
+    log.info('Preloaded {files} data files for {years} in {seconds:.2f}s '
+             '({memory} bytes of data, max RSS grew {rss} bytes)'.format(
+                 **out))
+    if stats['evictions'] > start_stats['evictions']:
+        log.warning('The data cache is too small to hold all years, consider '
+                    'increasing DATA_CACHE_MAX_BYTES')
+
+    return out
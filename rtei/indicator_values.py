@@ -0,0 +1,154 @@
+'''
+Compact storage for the indicator values of the countries of a year (the
+`{country_code}.json` data files).
+
+All countries of a year share an `IndicatorSchema`, which assigns each
+indicator code a slot. The values of each country are then stored in a
+`CountryValues` object as two arrays indexed by slot: the kind of each value
+(which also works as a mask for the missing ones) and the value itself, as a
+float. Strings are stored once per year in the schema, and values only hold
+their position. `CountryValues` is a read-only `Mapping`, so it can be used
+like the dict loaded from the JSON file (eg by `get_indicator_value`).
+
+This is used by the site to keep all years loaded with a fraction of the
+memory the dicts need.
+'''
+import sys
+from array import array
+from collections.abc import Mapping
+
+
+# Kinds of values. The missing value markers written by build_data.py (999 is
+# 'No data' and 997 'N/A') get their own kind, so they don't need a slot on
+# the strings of the schema
+ABSENT = 0
+NUMBER = 1
+INTEGER = 2
+STRING = 3
+OBJECT = 4
+NO_DATA = 5
+NOT_APPLICABLE = 6
+INSUFFICIENT_DATA = 7
+
+MISSING_VALUES = {
+    NO_DATA: 'No data',
+    NOT_APPLICABLE: 'N/A',
+    INSUFFICIENT_DATA: 'Insufficient data',
+}
+MISSING_KINDS = dict((value, kind) for kind, value in MISSING_VALUES.items())
+
+
+class IndicatorSchema(object):
+    '''
+    Slots for the indicator codes of a year, and the strings and other
+    non-numeric values (eg `None`) used by its countries.
+
+    Codes and values are added as countries are loaded with `add_country`,
+    and existing slots never change.
+    '''
+
+    def __init__(self, codes=()):
+        self.codes = []
+        self.slots = {}
+        self.objects = []
+        self.object_slots = {}
+        for code in codes:
+            self.get_slot(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def get_slot(self, code):
+        slot = self.slots.get(code)
+        if slot is None:
+            slot = self.slots[code] = len(self.codes)
+            self.codes.append(code)
+        return slot
+
+    def get_object_slot(self, value):
+        # Include the type, so eg `True` and `1` don't share a slot
+        key = (type(value), value)
+        slot = self.object_slots.get(key)
+        if slot is None:
+            slot = self.object_slots[key] = len(self.objects)
+            self.objects.append(value)
+        return slot
+
+    def add_country(self, values):
+        '''
+        Given the dict loaded from a country data file, returns its values as
+        a `CountryValues` object.
+        '''
+        slots = [self.get_slot(code) for code in values]
+        kinds = array('B', bytes(len(self.codes)))
+        numbers = array('d', bytes(8 * len(self.codes)))
+
+        for slot, value in zip(slots, values.values()):
+            if isinstance(value, str):
+                kind = MISSING_KINDS.get(value)
+                if kind is None:
+                    kind = STRING
+                    numbers[slot] = self.get_object_slot(value)
+            elif type(value) is float:
+                kind = NUMBER
+                numbers[slot] = value
+            elif type(value) is int and float(value) == value:
+                kind = INTEGER
+                numbers[slot] = value
+            else:
+                kind = OBJECT
+                numbers[slot] = self.get_object_slot(value)
+            kinds[slot] = kind
+
+        return CountryValues(self, kinds, numbers, slots)
+
+
+class CountryValues(Mapping):
+    '''
+    Read-only view of the indicator values of a country, keyed by code in the
+    same order as its data file.
+    '''
+
+    __slots__ = ('schema', 'kinds', 'numbers', 'order')
+
+    def __init__(self, schema, kinds, numbers, order):
+        self.schema = schema
+        self.kinds = kinds
+        self.numbers = numbers
+        self.order = array('H', order)
+
+    def __getitem__(self, code):
+        slot = self.schema.slots[code]
+        # Codes added to the schema after this country have no value
+        if slot >= len(self.kinds):
+            raise KeyError(code)
+        kind = self.kinds[slot]
+        if kind == NUMBER:
+            return self.numbers[slot]
+        elif kind == INTEGER:
+            return int(self.numbers[slot])
+        elif kind == STRING or kind == OBJECT:
+            return self.schema.objects[int(self.numbers[slot])]
+        elif kind == ABSENT:
+            raise KeyError(code)
+        return MISSING_VALUES[kind]
+
+    def __iter__(self):
+        codes = self.schema.codes
+        return (codes[slot] for slot in self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, code):
+        slot = self.schema.slots.get(code)
+        return (slot is not None and slot < len(self.kinds) and
+                self.kinds[slot] != ABSENT)
+
+    def __sizeof__(self):
+        # The schema is shared by all countries, so it's not included
+        return (object.__sizeof__(self) + sys.getsizeof(self.kinds) +
+                sys.getsizeof(self.numbers) + sys.getsizeof(self.order))
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, dict(self))
@@ -1,11 +1,17 @@
 
 import sys
 import json
-from collections import OrderedDict
+import hashlib
+import os
 from smtplib import SMTPException
 
 from django.db import models
-from django.http import Http404
+from django.http import Http404, HttpResponse
+from django.core.cache import cache
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils import translation
 from django.utils.translation import ugettext as _
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.validators import RegexValidator, URLValidator
@@ -45,7 +51,30 @@ def get_chart_labels(indicators, themes):
     return chart_labels
 
 
-def get_map_context(context, year):
+_chart_labels_cache = {}
+
+
+def get_chart_labels_json(dataset):
+    '''
+    Returns the output of `get_chart_labels` for a year dataset serialized as
+    JSON, in the active language.
+
+    This is cached for each year and language until the data is rebuilt.
+    '''
+    key = (dataset.year, translation.get_language())
+
+    cached = _chart_labels_cache.get(key)
+    if cached and cached[0] == dataset.version:
+        return cached[1]
+
+    chart_labels = json.dumps(
+        get_chart_labels(dataset.indicators, dataset.themes))
+    _chart_labels_cache[key] = (dataset.version, chart_labels)
+
+    return chart_labels
+
+
+def get_map_context(context, dataset):
     '''
     In the map page we pass the level 1 and 2 indicators to the
     template with the `indicators` variable. It has the following form:
@@ -83,12 +112,17 @@ def get_map_context(context, year):
     We also pass the `themes` variable to build the second menu, with
     identical format.
 
+    The indicator lists are rendered from `indicator_rows` and
+    `theme_indicator_rows`, the same trees flattened (see `YearDataset`).
+
     '''
-    context['indicators'] = data.get_indicators(year)
-    context['themes'] = data.get_themes(year)
+    context['indicators'] = dataset.indicators
+    context['themes'] = dataset.themes
+    context['indicator_rows'] = dataset.indicator_rows
+    context['theme_indicator_rows'] = dataset.theme_indicator_rows
 
 
-def get_country_context(context, country_code, year):
+def get_country_context(context, country_code, dataset):
     '''In the RTEI by Country page we pass the following variables:
 
     * `available_countries`: a dict with the countries where data is avaiable,
@@ -104,7 +138,8 @@ def get_country_context(context, country_code, year):
 
     * `country_code`
     * `country_name`
-    * `country_indicators`: full indicators data for the country, in the form:
+    * `country_indicators`: full indicators data for the country (a
+        `CountryValues` mapping), in the form:
 
         {
             '1': 74.34,
@@ -113,6 +148,10 @@ def get_country_context(context, country_code, year):
             ...
         }
 
+    * `display_values`: the values of the indicators as shown on the
+        indicator trees, translated and rounded (see
+        `YearDataset.get_display_values`)
+
     * `chart_data`: data necessary to build the C3 chart for just this
         particular country, eg:
 
@@ -129,7 +168,7 @@ def get_country_context(context, country_code, year):
     '''
 
     if country_code:
-        country_data = data.get_indicators_for_country(country_code, year)
+        country_data = dataset.countries.get(country_code)
         if not country_data:
             raise Http404(_('No data available for this country'))
 
@@ -138,30 +177,79 @@ def get_country_context(context, country_code, year):
         context['country_name'] = data.get_country_name(country_code)
 
         context['country_indicators'] = country_data
+        context['display_values'] = dataset.get_display_values(
+            country_code, translation.get_language())
+
+        chart_data = dataset.c3_scores_by_country.get(country_code)
+        if chart_data:
+            context['chart_data'] = json.dumps([chart_data])
+        context['indicators'] = dataset.indicators
+        context['themes'] = dataset.themes
+        context['indicator_rows'] = dataset.indicator_rows
+        context['theme_indicator_rows'] = dataset.theme_indicator_rows
+
+        context['chart_labels'] = get_chart_labels_json(dataset)
+
+    context['available_countries'] = dataset.get_available_countries(
+        translation.get_language())
+
+
+def get_theme_context(context, dataset):
+    context['indicators'] = dataset.indicators
+    context['themes'] = dataset.themes
+    context['indicator_rows'] = dataset.indicator_rows
+    context['theme_indicator_rows'] = dataset.theme_indicator_rows
+    context['chart_labels'] = get_chart_labels_json(dataset)
 
-        for country in data.get_c3_scores_per_country(year):
-            if country['name'] == context['country_name']:
-                chart_data = country
-                break
 
-        context['chart_data'] = json.dumps([chart_data])
-        context['indicators'] = data.get_indicators(year)
-        context['themes'] = data.get_themes(year)
+# Pages whose output only depends on the year, country and language, so their
+# responses can be cached (see `RTEIPage.serve`)
+DATA_PAGE_SLUGS = ['map', 'rtei-country', 'rtei-theme']
 
-        context['chart_labels'] = json.dumps(
-            get_chart_labels(context['indicators'], context['themes']))
 
-    context['available_countries'] = OrderedDict(
-        sorted(list({code: data.get_country_name(code) for code, c
-                in data.get_scores_per_country(year).items()}.items()),
-               key=lambda t: t[1]))
+def get_site_pages_version():
+    '''
+    Returns a `(version, timestamp)` tuple for the pages of the site, which
+    are used for the menus of the data pages: the number of live pages and
+    the last time any of them was published. It comes from the database, so
+    all processes get the same one.
+
+    Unpublishing a page is not recorded with a date, so it only changes the
+    version.
+    '''
+    pages = Page.objects.live().aggregate(
+        count=models.Count('id'),
+        last_published_at=models.Max('last_published_at'))
+    last_published_at = pages['last_published_at']
+    if last_published_at is None:
+        return str(pages['count']), 0
+    return ('{0}:{1}'.format(pages['count'], last_published_at.isoformat()),
+            last_published_at.timestamp())
 
 
-def get_theme_context(context, year):
-    context['indicators'] = data.get_indicators(year)
-    context['themes'] = data.get_themes(year)
-    context['chart_labels'] = json.dumps(
-        get_chart_labels(context['indicators'], context['themes']))
+_release = None
+
+
+def get_release():
+    '''
+    Returns a `(version, timestamp)` tuple for the deployed code, so the data
+    page responses change on each deploy: `settings.RELEASE_VERSION` and a
+    hash of the static files manifest written by `collectstatic` (the pages
+    link to the hashed file names it contains), and the time the manifest was
+    written. This is computed once per process.
+    '''
+    global _release
+    if _release is None:
+        version = getattr(settings, 'RELEASE_VERSION', '')
+        modified = 0
+        manifest_name = getattr(staticfiles_storage, 'manifest_name', None)
+        if manifest_name and staticfiles_storage.exists(manifest_name):
+            path = staticfiles_storage.path(manifest_name)
+            with open(path, 'rb') as f:
+                version += ':' + hashlib.md5(f.read()).hexdigest()
+            modified = os.stat(path).st_mtime
+        _release = (version, modified)
+    return _release
 
 
 class RTEIPage(Page):
@@ -172,22 +260,143 @@ class RTEIPage(Page):
         FieldPanel('body', classname="full")
     ]
 
-    def get_context(self, request):
-        context = super(RTEIPage, self).get_context(request)
-
+    def get_year(self, request):
         year = request.GET.get('year')
         if not year or year not in settings.YEARS:
             year = settings.YEARS[-1]
+        return year
+
+    def is_cacheable(self, request):
+        '''
+        Returns True if the response to a request only depends on the year,
+        country, language and data version, ie if it is a GET request to one
+        of the data pages from an anonymous user and not a preview.
+        '''
+        return (self.slug in DATA_PAGE_SLUGS and
+                request.method in ('GET', 'HEAD') and
+                not getattr(request, 'is_preview', False) and
+                not request.user.is_authenticated)
+
+    def get_validators(self, dataset):
+        '''
+        Returns the ETag and Last-Modified (as a timestamp) values for the
+        responses of the page, which change with the active language and:
+
+        * The data version of the year.
+        * The available years (shown on the year selector).
+        * The deployed release (see `get_release`).
+        * The site pages, which are used for the menus (see
+          `get_site_pages_version`).
+        * The page revisions.
+        '''
+        release, release_modified = get_release()
+        pages_version, pages_modified = get_site_pages_version()
+        page_dates = [date for date in (self.latest_revision_created_at,
+                                        self.last_published_at) if date]
+        key = ':'.join(
+            [dataset.version, translation.get_language(),
+             ','.join(settings.YEARS), release, pages_version] +
+            [date.isoformat() for date in page_dates])
+        etag = '"{0}"'.format(hashlib.md5(key.encode('utf-8')).hexdigest())
+        last_modified = int(max(
+            [dataset.modified, release_modified, pages_modified] +
+            [date.timestamp() for date in page_dates]))
+        return etag, last_modified
+
+    def get_cache_key(self, request, year, country_code, etag):
+        '''
+        Returns the key to cache the response to a request under. Keys include
+        the year and country, and the ETag of the response (see
+        `get_validators`), so they change with everything else the response
+        depends on.
+        '''
+        key = ':'.join([request.path, year, country_code, etag])
+        return 'rtei-page:{0}:{1}'.format(
+            self.pk, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def serve(self, request, *args, **kwargs):
+        '''
+        Responses to cacheable requests (see `is_cacheable`) get ETag,
+        Last-Modified and Cache-Control headers, and a 304 response if the
+        client already has the current version. If `PAGE_CACHE_TIMEOUT` is
+        set they are also cached.
+        '''
+        if not self.is_cacheable(request):
+            return super(RTEIPage, self).serve(request, *args, **kwargs)
+
+        year = self.get_year(request)
+        # Also used by `get_context`, so the page is rendered with the same
+        # version of the data it is cached and tagged with
+        dataset = request.rtei_dataset = data.get_dataset(year)
+
+        country_code = ''
+        if self.slug == 'rtei-country':
+            country_code = request.GET.get('id') or ''
+            if country_code and country_code not in dataset.country_codes:
+                # Not found
+                return super(RTEIPage, self).serve(request, *args, **kwargs)
+
+        etag, last_modified = self.get_validators(dataset)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+
+        if response is None:
+            timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 0)
+            cache_key = (timeout and
+                         self.get_cache_key(request, year, country_code,
+                                            etag))
+            cached = cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = super(RTEIPage, self).serve(
+                    request, *args, **kwargs)
+                if cache_key:
+                    def cache_response(response):
+                        if response.status_code == 200:
+                            cache.set(cache_key, (response.content,
+                                                  response['Content-Type']),
+                                      timeout)
+                    response.add_post_render_callback(cache_response)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(
+            response, public=True,
+            max_age=getattr(settings, 'PAGE_MAX_AGE', 0),
+            s_maxage=getattr(settings, 'PAGE_SHARED_MAX_AGE', 0))
+
+        return response
+
+    def get_context(self, request):
+        context = super(RTEIPage, self).get_context(request)
+
+        year = self.get_year(request)
 
         context['year'] = year
         context['all_years'] = settings.YEARS
 
+        if self.slug not in DATA_PAGE_SLUGS:
+            return context
+
+        # Use the same version of the data for the whole request, even if a
+        # new one is loaded in the meantime (see `serve`)
+        dataset = getattr(request, 'rtei_dataset', None)
+        if dataset is None or dataset.year != year:
+            dataset = data.get_dataset(year)
+
+        # Used by the `cache` tags around the indicator trees
+        context['data_version'] = dataset.version
+        context['tree_cache_timeout'] = getattr(
+            settings, 'TREE_CACHE_TIMEOUT', 0)
+
         if self.slug == 'map':
-            get_map_context(context, year)
+            get_map_context(context, dataset)
         elif self.slug == 'rtei-country':
-            get_country_context(context, request.GET.get('id'), year)
+            get_country_context(context, request.GET.get('id'), dataset)
         elif self.slug == 'rtei-theme':
-            get_theme_context(context, year)
+            get_theme_context(context, dataset)
 
         return context
 
@@ -161,6 +161,37 @@ STATICFILES_FINDERS = [
 # There needs to be a matching folder with data files on `rtei/static/data`
 YEARS = ['2015', '2016', '2018', '2021']
 
+# Maximum memory (in bytes) used by the parsed data files that each process
+# keeps cached (see `rtei.data.FileCache`)
+DATA_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# How often (in seconds) the cached data files (and the data version of each
+# year, see `rtei.data.get_dataset`) are checked for changes
+DATA_CACHE_CHECK_INTERVAL = 1
+
+# Seconds that the responses of the map, country and theme pages are cached
+# for anonymous users, on the default cache (see `rtei.models.RTEIPage`). Set
+# to 0 to disable it
+PAGE_CACHE_TIMEOUT = 0
+
+# Cache-Control max-age and s-maxage (for CDNs and other shared caches) of the
+# responses of the map, country and theme pages for anonymous users. Once they
+# expire, clients can check if they are still valid with their ETag
+PAGE_MAX_AGE = 0
+PAGE_SHARED_MAX_AGE = 60
+
+# Identifies the deployed release of the code, so the ETags of the pages above
+# change on each deploy (the static files manifest is also taken into
+# account). Uses the Heroku dyno metadata if enabled
+RELEASE_VERSION = os.environ.get('HEROKU_RELEASE_VERSION', '')
+
+# Seconds that the rendered indicator and theme trees of the data pages are
+# cached for, for each year, country and language (on the `template_fragments`
+# cache if there is one, or the default one). Each one takes a few hundred KB,
+# so configure a bounded cache for them before enabling it. Set to 0 to
+# disable it
+TREE_CACHE_TIMEOUT = 0
+
 STATICFILES_DIRS = [
     os.path.join(PROJECT_DIR, 'static'),
 ]
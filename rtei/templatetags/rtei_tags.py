@@ -1,10 +1,13 @@
-import os
+from functools import lru_cache
 
 from django import template
+from django.utils.encoding import force_text
+from django.utils.formats import localize
+from django.utils.safestring import SafeData, mark_safe
 from django.utils.translation import ugettext as _, get_language
 
 from rtei.models import Page, RTEIAncillaryPage, BlogPage
-from rtei.data import get_file_path
+from rtei.data import get_available_country_codes, get_display_value
 
 import logging
 log = logging.getLogger(__name__)
@@ -91,24 +94,109 @@ def breadcrumbs(context):
 
 @register.simple_tag
 def get_indicator_value(dictionary, code, level):
-    value = dictionary.get(code, '')
-    if isinstance(value, str):
-        value = _(value)
-    elif value and level:
-        if level < 3:
-            value = int(round(value))
-        else:
-            value = round(value, 2)
-    return value
+    return get_display_value(dictionary.get(code, ''), level)
 
 
-@register.inclusion_tag('rtei/tags/indicators.html')
-def indicators_list(indicators, country_indicators, is_theme):
-    return {
-        'indicators': indicators,
-        'country_indicators': country_indicators,
-        'is_theme': is_theme,
-    }
+# Same replacements as `django.utils.html.escape`
+ESCAPE_TABLE = {
+    ord('&'): '&amp;',
+    ord('<'): '&lt;',
+    ord('>'): '&gt;',
+    ord('"'): '&quot;',
+    ord("'"): '&#39;',
+}
+
+
+def render_value(value):
+    '''
+    Returns a value as rendered by `{{ value }}` on a template.
+    '''
+    if not isinstance(value, str):
+        value = force_text(localize(value))
+    if isinstance(value, SafeData):
+        return value
+    return value.translate(ESCAPE_TABLE)
+
+
+@lru_cache(maxsize=4096)
+def render_title(title, language):
+    '''
+    Returns a title as rendered by `{% trans title %}` on a template (which
+    escapes `%` before looking up the translation) in the active language,
+    which must be `language`.
+    '''
+    return render_value(_(title.replace('%', '%%')))
+
+
+@register.simple_tag
+def indicator_tree(rows, display_values):
+    '''
+    Renders a tree of indicators (or themes) in one pass, given its flattened
+    `(depth, node)` rows (see `rtei.code_tree.flatten_tree`) and the display
+    values of a country (see `YearDataset.get_display_values`), if any.
+
+    The output is exactly the same, whitespace included, as the recursive
+    template the trees were rendered with before, which is kept in
+    `bin/benchmark_indicator_tree.py` as the reference.
+    '''
+    language = get_language()
+    out = ['\n\n']
+    # Nodes whose <li> hasn't been closed yet, as `(depth, has_children)`
+    open_nodes = []
+    hidden_depth = None
+
+    def close_nodes(depth):
+        while open_nodes and open_nodes[-1][0] >= depth:
+            if open_nodes.pop()[1]:
+                out.append('\n\n        </ul>\n      ')
+            out.append('\n    </li>\n  \n')
+
+    for depth, node in rows:
+        # Skip the children of hidden nodes
+        if hidden_depth is not None:
+            if depth > hidden_depth:
+                continue
+            hidden_depth = None
+
+        close_nodes(depth)
+
+        if node.get('show_in_menu') is False:
+            out.append('\n  \n')
+            hidden_depth = depth
+            continue
+
+        code = render_value(node.get('code', ''))
+        title = ''
+        if 'title' in node:
+            title = render_title(node['title'], language)
+        out.append(
+            '\n  \n    <li id="indicator_container_{0}" '
+            'class="indicator-container">\n'
+            '      <div id="indicator_item_{0}" class="indicator">\n'
+            '        <span class="indicator-title">\n'
+            '          <span class="code">{0}</span>{1}\n'
+            '        </span>\n\n        '.format(
+                code, title))
+
+        if display_values:
+            value = display_values.get(
+                (node.get('code', ''), node.get('level')), '')
+            out.append(
+                '\n        <span class="indicator-value">\n          '
+                '\n          {0}\n        </span>\n        '.format(
+                    render_value(value)))
+
+        out.append('\n      </div>\n      ')
+
+        has_children = bool(node.get('children'))
+        if has_children:
+            out.append('\n        <ul>\n        \n\n')
+        open_nodes.append((depth, has_children))
+
+    close_nodes(0)
+    out.append('\n')
+
+    return mark_safe(''.join(out))
 
 
 @register.inclusion_tag('rtei/tags/left_menu.html')
@@ -177,8 +265,7 @@ def resource_list_item(result):
 
 @register.filter
 def country_available(country_code, year):
-    return os.path.exists(
-        get_file_path('{0}.json'.format(country_code), year))
+    return country_code in get_available_country_codes(year)
 
 
 @register.simple_tag
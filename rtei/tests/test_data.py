@@ -0,0 +1,238 @@
+import json
+import os
+import shutil
+import tempfile
+
+from collections import OrderedDict
+from unittest import mock
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.utils import translation
+
+from rtei import data
+from rtei.data import FileCache, get_memory_size, load_json_file
+
+
+class FileCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def write_file(self, file_name, value=None, content=None):
+        '''
+        Writes `value` as JSON (or the raw `content`) the way build_data.py
+        does, replacing the existing file.
+        '''
+        path = os.path.join(self.data_dir, file_name)
+        if content is None:
+            content = json.dumps(value)
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def test_get(self):
+        path = self.write_file('a.json', {'b': 1, 'a': 2})
+        cache = FileCache(1024 * 1024)
+
+        value = cache.get(path)
+
+        self.assertEqual(value, {'b': 1, 'a': 2})
+        self.assertIsInstance(value, OrderedDict)
+        self.assertEqual(list(value.keys()), ['b', 'a'])
+        self.assertNotIsInstance(cache.get(path, ordered_dict=False),
+                                 OrderedDict)
+
+    def test_get_cached(self):
+        path = self.write_file('a.json', {'a': 1})
+        cache = FileCache(1024 * 1024)
+
+        value = cache.get(path)
+
+        self.assertIs(cache.get(path), value)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['memory'], get_memory_size(value))
+
+    def test_file_rewritten(self):
+        path = self.write_file('a.json', {'a': 1})
+        cache = FileCache(1024 * 1024)
+        cache.get(path)
+
+        self.write_file('a.json', {'a': 2})
+
+        self.assertEqual(cache.get(path), {'a': 2})
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_file_rewritten_check_interval(self):
+        path = self.write_file('a.json', {'a': 1})
+        cache = FileCache(1024 * 1024, check_interval=60)
+        cache.get(path)
+
+        self.write_file('a.json', {'a': 2})
+
+        # Not checked again until the interval passes, unless forced
+        self.assertEqual(cache.get(path), {'a': 1})
+        self.assertEqual(cache.get(path, check=True), {'a': 2})
+        self.assertEqual(cache.get(path), {'a': 2})
+
+    def test_file_rewritten_derived(self):
+        path = self.write_file('a.json', {'a': 1})
+        cache = FileCache(1024 * 1024)
+
+        self.assertEqual(cache.get_derived(path, 'keys', list), ['a'])
+
+        self.write_file('a.json', {'b': 1})
+
+        self.assertEqual(cache.get_derived(path, 'keys', list), ['b'])
+
+    def test_file_removed(self):
+        path = self.write_file('a.json', {'a': 1})
+        cache = FileCache(1024 * 1024)
+        cache.get(path)
+
+        os.remove(path)
+
+        with self.assertRaises(FileNotFoundError):
+            cache.get(path)
+
+    def test_eviction(self):
+        paths = [self.write_file('{0}.json'.format(i), {'a': i})
+                 for i in range(3)]
+        # Room for two of them
+        memory = max(get_memory_size(load_json_file(path)) for path in paths)
+        cache = FileCache(memory * 2)
+
+        cache.get(paths[0])
+        cache.get(paths[1])
+        # Make the first one the most recently used
+        cache.get(paths[0])
+        cache.get(paths[2])
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertLessEqual(stats['memory'], cache.max_bytes)
+        self.assertEqual(
+            sorted(path for path, ordered_dict in cache.entries),
+            [paths[0], paths[2]])
+
+    def test_file_over_max_bytes(self):
+        small_path = self.write_file('small.json', {'a': 1})
+        big_path = self.write_file('big.json', list(range(1000)))
+        cache = FileCache(get_memory_size(load_json_file(big_path)) - 1)
+        cache.get(small_path)
+
+        value = cache.get(big_path)
+
+        self.assertEqual(value, list(range(1000)))
+        # Not cached, and nothing else was evicted to make room for it
+        self.assertIsNot(cache.get(big_path), value)
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['evictions'], 0)
+
+    def test_empty_payloads(self):
+        cache = FileCache(1024 * 1024)
+
+        for file_name, content in (('object.json', {}),
+                                   ('list.json', []),
+                                   ('string.json', '')):
+            path = self.write_file(file_name, content)
+            value = cache.get(path)
+            self.assertEqual(value, content)
+            self.assertIs(cache.get(path), value)
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['hits'], 3)
+
+    def test_empty_file(self):
+        path = self.write_file('a.json', content='')
+        cache = FileCache(1024 * 1024)
+
+        with self.assertRaises(ValueError):
+            cache.get(path)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+        self.write_file('a.json', {'a': 1})
+
+        self.assertEqual(cache.get(path), {'a': 1})
+
+
+class GetDatasetTestCase(SimpleTestCase):
+
+    year = '2021'
+
+    def tearDown(self):
+        data._datasets.pop(self.year, None)
+
+    def test_reload_error_keeps_current(self):
+        current = data.get_dataset(self.year)
+        # Force a version check
+        data._datasets[self.year] = (current, 0)
+
+        with mock.patch('rtei.data.get_data_version', return_value='new'), \
+                mock.patch('rtei.data.YearDataset',
+                           side_effect=ValueError('Broken file')), \
+                self.assertLogs('rtei.data', 'ERROR'):
+            self.assertIs(data.get_dataset(self.year), current)
+
+        # Not loaded again until the next check
+        self.assertIs(data._datasets[self.year][0], current)
+        self.assertGreater(data._datasets[self.year][1], 0)
+
+    def test_first_load_error(self):
+        data._datasets.pop(self.year, None)
+
+        with mock.patch('rtei.data.YearDataset',
+                        side_effect=ValueError('Broken file')):
+            with self.assertRaises(ValueError):
+                data.get_dataset(self.year)
+
+        self.assertNotIn(self.year, data._datasets)
+
+
+class DisplayValuesTestCase(SimpleTestCase):
+
+    def test_display_values(self):
+        for year in settings.YEARS:
+            dataset = data.get_dataset(year)
+            for language, name in settings.LANGUAGES:
+                with translation.override(language):
+                    for country_code, values in dataset.countries.items():
+                        display_values = dataset.get_display_values(
+                            country_code, language)
+                        for code, level in dataset.display_index:
+                            value = data.get_display_value(
+                                values.get(code, ''), level)
+                            display_value = display_values.get((code, level))
+                            self.assertEqual(display_value, value)
+                            self.assertIs(type(display_value), type(value))
+
+    def test_missing_node(self):
+        dataset = data.get_dataset('2021')
+        display_values = dataset.get_display_values(
+            sorted(dataset.countries)[0], 'en')
+
+        self.assertIsNone(display_values.get(('0', 1)))
+        self.assertEqual(display_values.get(('0', 1), ''), '')
+
+    def test_language_not_preloaded(self):
+        dataset = data.get_dataset('2021')
+        country_code = sorted(dataset.countries)[0]
+
+        with translation.override('fr'):
+            expected = dataset.get_display_values(country_code, 'fr')
+            with mock.patch.dict(dataset.display_strings, clear=True,
+                                 en=dataset.display_strings['en']):
+                display_values = dataset.get_display_values(
+                    country_code, 'fr')
+                for key in dataset.display_index:
+                    self.assertEqual(display_values.get(key),
+                                     expected.get(key))
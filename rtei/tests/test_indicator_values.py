@@ -0,0 +1,95 @@
+import glob
+import os
+
+from collections import OrderedDict
+from django.test import SimpleTestCase
+
+from rtei.data import get_file_path, load_json_file
+from rtei.indicator_values import IndicatorSchema
+
+
+class CountryValuesTestCase(SimpleTestCase):
+
+    def assertSameValues(self, country_values, values):
+        self.assertEqual(list(country_values), list(values))
+        self.assertEqual(len(country_values), len(values))
+        for code, value in values.items():
+            self.assertIn(code, country_values)
+            self.assertEqual(country_values[code], value)
+            self.assertIs(type(country_values[code]), type(value))
+        self.assertEqual(list(country_values.items()), list(values.items()))
+
+    def test_values(self):
+        values = OrderedDict([
+            ('index', 68.78),
+            ('1', 100),
+            ('1.1', 56.334),
+            ('1.1.1', 'Yes'),
+            ('1.1.2', 'No data'),
+            ('1.1.3', 'N/A'),
+            ('1.1.4', 'Insufficient data'),
+            ('1.1.5', None),
+            ('1.1.6', True),
+            ('1.1.7', 0),
+            ('1.1.8', 0.0),
+            ('1.1.9', ''),
+            ('1.1.10', -2.5),
+        ])
+        schema = IndicatorSchema()
+
+        self.assertSameValues(schema.add_country(values), values)
+
+    def test_order(self):
+        schema = IndicatorSchema(['1', '1.1', '1.2', '2'])
+        first = OrderedDict([('2', 1), ('1.2', 2), ('1', 3)])
+        second = OrderedDict([('1.1', 'Yes'), ('2', 0.5), ('3', 'No')])
+
+        first_values = schema.add_country(first)
+        second_values = schema.add_country(second)
+
+        self.assertSameValues(first_values, first)
+        self.assertSameValues(second_values, second)
+
+    def test_shared_strings(self):
+        schema = IndicatorSchema()
+        first = schema.add_country({'1': 'Yes', '2': 1})
+        second = schema.add_country({'1': 1, '2': 'Yes', '3': True})
+
+        self.assertEqual(schema.objects, ['Yes', True])
+        self.assertIs(first['1'], second['2'])
+        self.assertIs(type(second['1']), int)
+        self.assertIs(second['3'], True)
+
+    def test_missing_codes(self):
+        schema = IndicatorSchema(['1', '2'])
+        country_values = schema.add_country({'1': 1})
+        # Added to the schema after the country
+        schema.add_country({'3': 3})
+
+        for code in ('2', '3', '4'):
+            self.assertNotIn(code, country_values)
+            self.assertIsNone(country_values.get(code))
+            with self.assertRaises(KeyError):
+                country_values[code]
+
+    def test_empty(self):
+        schema = IndicatorSchema(['1'])
+        country_values = schema.add_country({})
+
+        self.assertSameValues(country_values, {})
+        self.assertEqual(dict(country_values), {})
+        self.assertNotIn('1', country_values)
+
+    def test_data_files(self):
+        for year_dir in sorted(glob.glob(get_file_path('*'))):
+            if not os.path.isdir(year_dir):
+                continue
+            schema = IndicatorSchema()
+            countries = []
+            for path in sorted(glob.glob(os.path.join(year_dir, '??.json'))):
+                values = load_json_file(path)
+                countries.append((values, schema.add_country(values)))
+            self.assertTrue(countries)
+            # Check them once all the countries of the year have been added
+            for values, country_values in countries:
+                self.assertSameValues(country_values, values)
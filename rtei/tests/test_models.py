@@ -0,0 +1,264 @@
+import copy
+import datetime
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from wagtail.core.models import Site
+
+from rtei import data
+from rtei.models import RTEIPage, RTEIAncillaryPage
+
+
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+
+@override_settings(STATICFILES_STORAGE=STATICFILES_STORAGE,
+                   PAGE_CACHE_TIMEOUT=300)
+class RTEIPageCacheTestCase(TestCase):
+
+    year = '2021'
+
+    @classmethod
+    def setUpTestData(cls):
+        root = Site.objects.get(is_default_site=True).root_page
+        explore = root.add_child(
+            instance=RTEIAncillaryPage(title='Explore', slug='explore'))
+        cls.page = explore.add_child(
+            instance=RTEIPage(title='Country', slug='rtei-country'))
+        cls.other_page = root.add_child(
+            instance=RTEIAncillaryPage(title='About', slug='about'))
+
+    def setUp(self):
+        cache.clear()
+        # Shared by all tests, and some of them change the pages
+        self.page.refresh_from_db()
+        self.other_page.refresh_from_db()
+        self.dataset = data.get_dataset(self.year)
+        self.country_code = sorted(self.dataset.countries)[0]
+        self.url = '/en/explore/rtei-country/?id={0}&year={1}'.format(
+            self.country_code, self.year)
+
+    def get(self, url=None, **kwargs):
+        return self.client.get(url or self.url, **kwargs)
+
+    def new_data_version(self):
+        '''
+        Returns a mock that makes requests get a new version of the data.
+        '''
+        dataset = copy.copy(self.dataset)
+        dataset.version = 'new'
+        return mock.patch('rtei.data.get_dataset', return_value=dataset)
+
+    def render_count(self):
+        '''
+        Returns a mock that counts the times the page is rendered.
+        '''
+        return mock.patch.object(RTEIPage, 'get_context', autospec=True,
+                                 side_effect=RTEIPage.get_context)
+
+    def test_cache_miss_and_hit(self):
+        with self.render_count() as get_context:
+            response = self.get()
+            cached_response = self.get()
+
+        self.assertEqual(get_context.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['Content-Type'],
+                         response['Content-Type'])
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertIn(self.country_code.encode('utf-8'), response.content)
+
+    def test_cache_key(self):
+        with self.render_count() as get_context:
+            self.get()
+            # Different language and year
+            self.get(self.url.replace('/en/', '/fr/'))
+            self.get(self.url.replace(self.year, settings.YEARS[0]))
+
+        self.assertEqual(get_context.call_count, 3)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_cache_disabled(self):
+        with self.render_count() as get_context:
+            self.get()
+            response = self.get()
+
+        self.assertEqual(get_context.call_count, 2)
+        self.assertIn('ETag', response)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_tree_cache(self):
+        fragment_key = make_template_fragment_key(
+            'indicator_trees', [self.year, self.country_code, 'en',
+                                self.dataset.version])
+        content = self.get().content
+        self.assertIsNone(cache.get(fragment_key))
+
+        with override_settings(TREE_CACHE_TIMEOUT=300):
+            cached_content = self.get().content
+
+        self.assertIn(cache.get(fragment_key).strip().encode('utf-8'),
+                      cached_content)
+        # Only the whitespace around it changes
+        self.assertEqual(cached_content.split(), content.split())
+
+    def test_purge_on_publish(self):
+        # Other pages change the menus
+        for page in (self.page, self.other_page):
+            self.get()
+            with self.render_count() as get_context:
+                page.save_revision().publish()
+                self.get()
+                self.get()
+
+            self.assertEqual(get_context.call_count, 1)
+
+    def test_purge_on_unpublish(self):
+        with self.render_count() as get_context:
+            self.get()
+            self.other_page.unpublish()
+            self.get()
+
+        self.assertEqual(get_context.call_count, 2)
+
+    def test_purge_on_new_data_version(self):
+        with self.render_count() as get_context:
+            self.get()
+            with self.new_data_version():
+                response = self.get()
+
+        self.assertEqual(get_context.call_count, 2)
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_cached_for_logged_in_users(self):
+        user = get_user_model().objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.get()
+        self.client.force_login(user)
+
+        with self.render_count() as get_context:
+            response = self.get()
+
+        self.assertEqual(get_context.call_count, 1)
+        self.assertNotIn('ETag', response)
+
+    def test_not_found_not_cached(self):
+        url = '/en/explore/rtei-country/?id=XX&year={0}'.format(self.year)
+
+        with self.render_count() as get_context:
+            self.assertEqual(self.get(url).status_code, 404)
+            self.assertEqual(self.get(url).status_code, 404)
+
+        self.assertEqual(get_context.call_count, 2)
+
+    def test_same_dataset_for_whole_request(self):
+        # A new version of the data is loaded after the first call
+        new_dataset = copy.copy(self.dataset)
+        new_dataset.version = 'new'
+        datasets = [self.dataset]
+
+        def get_dataset(year):
+            datasets.append(new_dataset)
+            return datasets[-2]
+
+        with mock.patch('rtei.data.get_dataset', side_effect=get_dataset):
+            response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['data_version'],
+                         self.dataset.version)
+
+    def test_not_modified(self):
+        response = self.get()
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        with self.render_count() as get_context:
+            not_modified = self.get(HTTP_IF_NONE_MATCH=etag)
+            not_modified_since = self.get(
+                HTTP_IF_MODIFIED_SINCE=last_modified)
+            modified = self.get(HTTP_IF_NONE_MATCH='"other"')
+
+        self.assertEqual(get_context.call_count, 0)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertIn('public', not_modified['Cache-Control'])
+        self.assertEqual(not_modified_since.status_code, 304)
+        self.assertEqual(modified.status_code, 200)
+        self.assertEqual(modified.content, response.content)
+
+    def test_etag_changes(self):
+        etag = self.get()['ETag']
+
+        self.assertNotEqual(
+            self.get(self.url.replace('/en/', '/fr/'))['ETag'], etag)
+        with self.new_data_version():
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_validators_change_on_publish(self):
+        response = self.get()
+
+        # Last-Modified has a resolution of seconds
+        published_at = timezone.now() + datetime.timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now',
+                        return_value=published_at):
+            self.other_page.save_revision().publish()
+
+        for headers in ({'HTTP_IF_NONE_MATCH': response['ETag']},
+                        {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+            new_response = self.get(**headers)
+            self.assertEqual(new_response.status_code, 200)
+            self.assertNotEqual(new_response['ETag'], response['ETag'])
+
+    def test_validators_change_on_release(self):
+        response = self.get()
+        release = ('new', time.time() + 60)
+
+        with mock.patch('rtei.models.get_release', return_value=release):
+            for headers in (
+                    {'HTTP_IF_NONE_MATCH': response['ETag']},
+                    {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+                new_response = self.get(**headers)
+                self.assertEqual(new_response.status_code, 200)
+                self.assertNotEqual(new_response['ETag'], response['ETag'])
+
+    def test_validators_change_on_unpublish(self):
+        etag = self.get()['ETag']
+
+        self.other_page.unpublish()
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_validators_shared_by_processes(self):
+        response = self.get()
+
+        # Eg another worker, with its own local memory cache
+        cache.clear()
+
+        not_modified = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['Last-Modified'],
+                         response['Last-Modified'])
+
+    def test_validators_change_with_years(self):
+        response = self.get()
+
+        with override_settings(YEARS=settings.YEARS[1:]):
+            new_response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(new_response.status_code, 200)
+        self.assertNotEqual(new_response['ETag'], response['ETag'])